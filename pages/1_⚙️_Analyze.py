@@ -1,4 +1,5 @@
 import os
+import time
 import streamlit as st
 from streamlit_plotly_events import plotly_events
 import subprocess
@@ -7,9 +8,8 @@ from src.view import *
 from src.fileupload import *
 from src.result_files import *
 from src.ini2dec import *
-import threading
 from src.captcha_ import *
-from src.run_subprocess import *
+from src.jobs import *
 
 params = page_setup()
 
@@ -82,12 +82,13 @@ if 'Trypsin' in NuXL_config['enzyme']['restrictions']:
 
 with st.form("fasta-upload", clear_on_submit=False):
 
-    # selected mzML file from mzML files list
-    selected_mzML_file = st.selectbox(
-        "choose mzML/raw file",
-        [item for item in mzML_files_ if not item.endswith(".csv")]
-        ,
-        help="If file not here, please upload at File Upload"
+    # selected mzML files from mzML files list, all are searched with the same fasta file and settings
+    mzML_options = [item for item in mzML_files_ if not item.endswith(".csv")]
+    selected_mzML_files = st.multiselect(
+        "choose mzML/raw files",
+        mzML_options,
+        default=mzML_options[:1],
+        help="Several files are searched as a batch, in parallel as far as cores and memory allow. If file not here, please upload at File Upload"
     )
 
     # select fasta file from mzML files list
@@ -98,10 +99,6 @@ with st.form("fasta-upload", clear_on_submit=False):
         help="If file not here, please upload at File Upload"
     )
 
-    # take full path of mzML file
-    if selected_mzML_file:
-        mzML_file_path = str(Path(st.session_state.workspace, "mzML-files", selected_mzML_file))
-
     # take full path of fasta file
     if selected_fasta_file:
         database_file_path = str(Path(st.session_state.workspace, "fasta-files", selected_fasta_file))
@@ -195,48 +192,118 @@ with st.form("fasta-upload", clear_on_submit=False):
 # out file path
 result_dir: Path = Path(st.session_state.workspace, "result-files")
 
-# create same output file path name as input file path
-mzML_file_name = os.path.basename(mzML_file_path)
-protocol_name = os.path.splitext(mzML_file_name)[0]
-result_path = os.path.join(result_dir, protocol_name + ".idXML")
-
 ##################################### NuXL command (subprocess) ############################
 
-# result dictionary to capture output of subprocess
-result_dict = {}
-result_dict["success"] = False
-result_dict["log"] = " "
-
-# create terminate flag from even function
-terminate_flag = threading.Event()
-terminate_flag.set()
-
-# terminate subprocess by terminate flag
-def terminate_subprocess():
-    global terminate_flag
-    terminate_flag.set()
+@st.fragment(run_every=2)
+def show_jobs():
+    """
+    Shows the analyses (background jobs) of the workspace, refreshed every 2 seconds. 
+
+    Returns:
+        None
+    """
+    jobs = list_jobs(st.session_state.workspace)
+    if not jobs:
+        return
+
+    st.write("Analyses")
+    now = time.time()
+    st.dataframe(pd.DataFrame({
+        "protocol": [job["name"] for job in jobs],
+        "status": [job["status"] + (" (cached)" if job.get("cached") else "") for job in jobs],
+        "submitted": [time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(job["created"])) for job in jobs],
+        "run time (min)": [round(((job["finished"] or now) - job["started"]) / 60, 1) if job["started"] else None for job in jobs],
+    }), use_container_width=True, hide_index=True)
+
+    # terminate a queued or running analysis, its processes are stopped and its partial outputs removed
+    active_jobs = {job["id"]: job for job in jobs if job["status"] in ACTIVE_JOB_STATES}
+    if active_jobs:
+        cols = st.columns([3, 1])
+        with cols[0]:
+            cancel_id = st.selectbox("analysis to terminate", list(active_jobs), key="terminate-job",
+                                     format_func=lambda job_id: f"{active_jobs[job_id]['name']} ({active_jobs[job_id]['status']}, {job_id})")
+        with cols[1]:
+            if st.button("Terminate", key="terminate-button", type="secondary"):
+                cancel_job(st.session_state.workspace, cancel_id)
+                st.warning(f"Analysis of {active_jobs[cancel_id]['name']} terminated, its partial results are removed.")
+
+    # last lines of the log of the newest running analysis, one element refreshed with the list
+    running_jobs = [job for job in jobs if job["status"] == JOB_RUNNING]
+    if running_jobs:
+        job = running_jobs[0]
+        log_tail = read_job_log(st.session_state.workspace, job["id"], "stdout", max_bytes=16384).splitlines()[-40:]
+        log_tail += read_job_log(st.session_state.workspace, job["id"], "stderr", max_bytes=4096).splitlines()[-10:]
+        with st.expander(f"log of {job['name']}", expanded=True):
+            st.code("\n".join(log_tail))
+
+    # an analysis finished, rerun the page to show its results
+    finished_jobs = [job["id"] for job in jobs if job["status"] not in ACTIVE_JOB_STATES]
+    if st.session_state.get("finished-jobs", finished_jobs) != finished_jobs:
+        st.session_state["finished-jobs"] = finished_jobs
+        st.rerun()
+    st.session_state["finished-jobs"] = finished_jobs
+
+def show_job_results(protocol_name):
+    """
+    Shows the output files of a finished analysis and a download link of its identification files. 
+
+    Args:
+        protocol_name: protocol name of the analysis (mzML file name without extension).
+
+    Returns:
+        None
+    """
+    # all result files in result-dir
+    All_files = [f.name for f in sorted(result_dir.iterdir())]
+
+    # filtered out all current run file from all resul-dir files
+    current_analysis_files = [s for s in All_files if protocol_name in s]
+
+    # add list of files to dataframe
+    df = pd.DataFrame({"output files ": current_analysis_files})
+
+    # show table of all list files of current protocol
+    show_table(df)
+
+    # check if perc files availabe in some cases could not run percolator e-g if identification hits are so less
+    perc_exec = any("_perc_" in string for string in current_analysis_files)
+
+    # just show and download the identification_files of XLs PSMs/PRTs if perc_XLs available otherwise without the percolator identification file
+    if perc_exec :
+        identification_files = [string for string in current_analysis_files if "_perc_0.0100_XLs"  in string or "_perc_0.1000_XLs" in string or "_perc_1.0000_XLs" in string or "_perc_proteins" in string]
+    else:
+        identification_files = [string for string in current_analysis_files if "_XLs"  in string or "_proteins" in string]
+
+    # then download link for identification file of above criteria 
+    download_selected_result_files(identification_files, f":arrow_down: {protocol_name}_XL_identification_files")
 
 # run analysis 
 if cols[0].form_submit_button("Run-analysis", type="primary"):
 
-    # To terminate subprocess and clear form
-    if st.button("Terminate/Clear", key="terminate-button", type="secondary"):
-        #terminate subprocess
-        terminate_subprocess()
+    # how many searches run at once and the threads of each, from the cores and the memory budget of the searches
+    max_cores = st.session_state.settings.get("search_max_cores", 0)
+    memory_budget_mb = st.session_state.settings.get("search_memory_budget_mb", 0)
+    memory_per_job_mb = st.session_state.settings.get("search_memory_per_job_mb", 0)
+    concurrency, threads = search_resources(len(selected_mzML_files), max_cores, memory_budget_mb, memory_per_job_mb)
+    # results of identical searches are reused from the search cache
+    cache_mb = st.session_state.settings.get("search_cache_mb", 0)
 
-        st.warning("Process terminated. The analysis may not be complete.")
-        #clear form
-        st.rerun() 
+    for selected_mzML_file in selected_mzML_files:
+        # take full path of mzML file
+        mzML_file_path = str(Path(st.session_state.workspace, "mzML-files", selected_mzML_file))
+
+        # create same output file path name as input file path
+        mzML_file_name = os.path.basename(mzML_file_path)
+        protocol_name = os.path.splitext(mzML_file_name)[0]
+        result_path = os.path.join(result_dir, protocol_name + ".idXML")
 
-    # with st.spinner("Running analysis... Please wait until analysis done 😑"): #without status/ just spinner button
-    with st.status("Running analysis... Please wait until analysis done 😑"):
         # If session state is local
         if st.session_state.location == "local":
 
             # If local in current directory of app  like bin and percolator folder
             OpenNuXL_exec = os.path.join(os.getcwd(),'bin', 'OpenNuXL')
             perc_exec = os.path.join(os.getcwd(), 'Percolator', 'percolator.exe') 
-            
+        
             args = [OpenNuXL_exec, "-in", mzML_file_path, "-database", database_file_path, "-out", result_path, "-NuXL:presets", preset, 
                         "-NuXL:length", length, "-NuXL:scoring", scoring, "-precursor:mass_tolerance",  Precursor_MT, "-precursor:mass_tolerance_unit",  Precursor_MT_unit,
                         "-fragment:mass_tolerance",  Fragment_MT, "-fragment:mass_tolerance_unit",  Fragment_MT_unit,
@@ -262,7 +329,7 @@ if cols[0].form_submit_button("Run-analysis", type="primary"):
                             "-peptide:min_size", peptide_min, "-peptide:max_size",peptide_max, "-peptide:missed_cleavages",Missed_cleavages, "-peptide:enzyme", Enzyme,
                             "-modifications:variable_max_per_peptide", Variable_max_per_peptide
                             ]
-            
+        
             else:
 
                     thermo_exec_path = "/thirdparty/ThermoRawFileParser/ThermoRawFileParser.exe"
@@ -274,7 +341,7 @@ if cols[0].form_submit_button("Run-analysis", type="primary"):
                                 "-modifications:variable_max_per_peptide", Variable_max_per_peptide
                                 ]
 
-        
+    
         # If variable modification provided
         if variable_modification: 
             args.extend(["-modifications:variable"])
@@ -284,63 +351,43 @@ if cols[0].form_submit_button("Run-analysis", type="primary"):
         if fixed_modification: 
             args.extend(["-modifications:fixed"])
             args.extend(fixed_modification)
-        
-        # Add any additional variables needed for the subprocess (if any)
-        variables = []  
 
         # want to see the command values and argues
         #message = f"Running '{' '.join(args)}'"
         #st.code(message)
 
-        # run subprocess command
-        run_subprocess(args, variables, result_dict)
-
-        #rename the file .raw.mzML --> .mzML
-        rename_files(Path(st.session_state.workspace, "mzML-files"))
-        
-
-        # Use st.experimental_thread to run the subprocess asynchronously
-        # terminate_flag = threading.Event()
-        # thread = threading.Thread(target=run_subprocess, args=(args, variables, result_dict))
-        # thread.start()
-        # thread.join()
-
-    # if run_subprocess success (no need if not success because error will show/display in run_subprocess command)
-    if result_dict["success"]:
-
-        # add .mzML.ambigious_masses.csv in result directory 
-        add_this_result_file(f"{protocol_name}.mzML.ambigious_masses.csv", Path(st.session_state.workspace, "mzML-files"))
-        
-        # remove .mzML.ambigious_masses.csv from mzML directory
-        remove_this_mzML_file(f"{protocol_name}.mzML.ambigious_masses.csv")
-
-        # Save the log to a text file in the result_dir
-        log_file_path = result_dir / f"{protocol_name}_log.txt"
-        with open(log_file_path, "w") as log_file:
-            log_file.write(result_dict["log"])
-
-        # all result files in result-dir
-        All_files = [f.name for f in sorted(result_dir.iterdir())]
-
-        # filtered out all current run file from all resul-dir files
-        current_analysis_files = [s for s in All_files if protocol_name in s]
-
-        # add list of files to dataframe
-        df = pd.DataFrame({"output files ": current_analysis_files})
-
-        # show table of all list files of current protocol
-        show_table(df)
-
-        # check if perc files availabe in some cases could not run percolator e-g if identification hits are so less
-        perc_exec = any("_perc_" in string for string in current_analysis_files)
-
-        # just show and download the identification_files of XLs PSMs/PRTs if perc_XLs available otherwise without the percolator identification file
-        if perc_exec :
-            identification_files = [string for string in current_analysis_files if "_perc_0.0100_XLs"  in string or "_perc_0.1000_XLs" in string or "_perc_1.0000_XLs" in string or "_perc_proteins" in string]
-        else:
-            identification_files = [string for string in current_analysis_files if "_XLs"  in string or "_proteins" in string]
-
-        # then download link for identification file of above criteria 
-        download_selected_result_files(identification_files, f":arrow_down: {protocol_name}_XL_identification_files")
+        # threads of this search
+        args.extend(["-threads", str(threads)])
+
+        # run the analysis in a detached worker process, it keeps running when the page is left or closed
+        submit_job(st.session_state.workspace, args, protocol_name, threads=threads, memory_mb=memory_per_job_mb,
+                   max_cores=max_cores, memory_budget_mb=memory_budget_mb, cache_mb=cache_mb)
+
+    if selected_mzML_files:
+        st.success(f"{len(selected_mzML_files)} analyses submitted, {concurrency} run at once with {threads} threads each. "
+                   "They keep running if you leave or close this page")
+        if cache_mb:
+            st.info("The results of analyses done before with the same files and settings are taken from the cache", icon="ℹ️")
+    if not selected_mzML_files:
+        st.warning("Please choose at least one mzML/raw file")
+
+# analyses of the workspace
+show_jobs()
+
+# results of a finished analysis
+finished_jobs = {job["id"]: job for job in list_jobs(st.session_state.workspace) if job["status"] not in ACTIVE_JOB_STATES}
+if finished_jobs:
+    job = finished_jobs[st.selectbox("show results of analysis", list(finished_jobs),
+                                     format_func=lambda job_id: f"{finished_jobs[job_id]['name']} ({finished_jobs[job_id]['status']}, {job_id})")]
+    if job["status"] == JOB_DONE:
+        show_job_results(job["name"])
+    elif job["status"] == JOB_CANCELLED:
+        st.info(f"Analysis of {job['name']} was terminated")
+    else:
+        st.error(f"Analysis of {job['name']} failed: {job['error']}")
+        # last lines of the error output
+        stderr = read_job_log(st.session_state.workspace, job["id"], "stderr")
+        if stderr:
+            st.code(stderr[-5000:])
 
 save_params(params)
\ No newline at end of file
@@ -1,8 +1,12 @@
 import streamlit as st
+import numpy as np
 from src.common import *
 from src.result_files import *
+from src.result_cache import load_CSM_table, load_CSM_tables, load_CSM_details, get_CSM_columns, query_CSM_table
 import plotly.graph_objects as go
-from src.view import plot_ms2_spectrum, plot_ms2_spectrum_full
+from src.query import run_query, list_tables, EXAMPLE_QUERY, DUCKDB_AVAILABLE
+from src.view import plot_ms2_spectrum_full, get_spectrum_figure
+from src.spectra import load_mzML_file, get_spectrum_peaks, get_spectrum_cache, match_annotations
 from st_aggrid import GridOptionsBuilder, AgGrid, GridUpdateMode, ColumnsAutoSizeMode
 from src.captcha_ import *
 from pyopenms import *
@@ -17,81 +21,404 @@ if 'controllo' not in st.session_state or params["controllo"] == False:
 
 ##################################
 
-#TODO move to src folder
-def process_mzML_file(filepath):
+def remove_substrings(original_string, substrings_to_remove):
+    modified_string = original_string
+    for substring in substrings_to_remove:
+        modified_string = modified_string.replace(substring, "")
+    return modified_string
+
+nuxl_out_pattern = ["_perc_0.0100_XLs.idXML", "_0.0100_XLs.idXML", "_perc_0.1000_XLs.idXML", "_0.1000_XLs.idXML", "_perc_1.0000_XLs.idXML", "_1.0000_XLs.idXML"]
+
+########################
+
+### fragments of the page, each one reruns alone when its own widgets change
+
+def memoised(name, input_file, compute):
     """
-    Loads an mzML file, extracts MS2 spectra, and normalizes the peak intensities.
+    Computes the content of a view once per result file, later reruns of the session reuse it.
+
+    The result is kept in the session state together with the content hash of the file,
+    so a changed (re-uploaded) file is computed again.
 
-    Parameters:
-    filepath (str): The file path to the mzML file.
+    Args:
+        name: name of the memoised content.
+        input_file: result file the content is computed from.
+        compute: function computing the content.
 
     Returns:
-    MSExperiment: An MSExperiment object containing the normalized MS2 spectra.
+        the (memoised) content
     """
+    key = f"memo-{name}"
+    file_key = (str(input_file), file_hash(input_file))
+    memo = st.session_state.get(key)
+    if memo is None or memo[0] != file_key:
+        # only the last selected file is kept per view
+        memo = (file_key, compute())
+        st.session_state[key] = memo
+    return memo[1]
+
+@st.fragment
+def show_spectrum(selected_file, selected_row, mzML_path, MS2, spectrum_cache):
+    """
+    Shows the spectrum of the selected CSM, changing the matching tolerance or the m/z range only reruns this panel.
 
-    try:
-        # Initialize an MSExperiment object
-        exp = MSExperiment()
-        
-        # Load the mzML file into the MSExperiment object
-        MzMLFile().load(filepath, exp)
+    Args:
+        selected_file: selected idXML file name.
+        selected_row: selected row of the CSM table (list with one row dict).
+        mzML_path: path of the corresponding mzML file.
+        MS2: spectra of the mzML file, None if the file is not available.
+        spectrum_cache: shared spectrum cache.
 
-        # Create a new MSExperiment object to store MS2 spectra
-        MS2 = MSExperiment()
-        
-        # Iterate over all spectra in the experiment
-        for spec in exp:
-            # Check if the spectrum is an MS2 spectrum
-            if spec.getMSLevel() == 2:
-                # Add the MS2 spectrum to the MS2 experiment object
-                MS2.addSpectrum(spec)
-
-        # Normalize peak intensities in the MS2 spectra
-        normalizer = Normalizer()  # Create a Normalizer object
-        param = normalizer.getParameters()  # Get the default parameters
-        param.setValue("method", "to_one")  # Set normalization method to "to_one"
-        normalizer.setParameters(param)  # Apply the parameters to the normalizer
-        normalizer.filterPeakMap(MS2)  # Normalize the peaks in the MS2 spectra
-
-        return MS2  # Return the MSExperiment object containing normalized MS2 spectra
-
-    except Exception as e:
-        return None  # Return None if any exception occurs
-
-def get_mz_intensities_from_ms2(MS2_spectras, native_id):
+    Returns:
+        None
+    """
+    # annotated peaks and other heavy payloads, only for the selected CSM
+    CSM_details = load_CSM_details(workspace_path / "result-files" /f"{selected_file}", selected_row[0]['SpecId'])
+
+    # Create a dictionary of annotation features
+    annotation_data_idxml = {'intarray': CSM_details['intarray'].tolist(),
+            'mzarray': CSM_details['mzarray'].tolist(),
+            'anotarray': CSM_details['anotarray'].tolist()
+        }
+
+    #annotation_data_idxml_df = pd.DataFrame(annotation_data_idxml)
+    #annotation_data_idxml_df.to_csv(str(selected_row[0]['ScanNr']) + "_idxml_annot.csv")
+
+    spectrum_peaks = None
+    if MS2 is not None:
+        # Extract m/z and intensity data from the selected MS2 spectrum
+        spectrum_peaks = get_spectrum_peaks(mzML_path, selected_row[0]['SpecId'], spectrum_cache)
+
+    if spectrum_peaks is not None:
+        mz_full, inten_full = spectrum_peaks
+
+        # fragment tolerance of the search, can be changed for matching the annotations
+        search_tolerance, search_unit = read_fragment_tolerance(workspace_path / "result-files" /f"{selected_file}")
+        col_tolerance, col_unit = st.columns(2)
+        tolerance = col_tolerance.number_input("fragment tolerance", min_value=0.0, value=search_tolerance, help="tolerance for matching annotated peaks to the spectrum")
+        unit = col_unit.selectbox("unit", ["ppm", "Da"], index=["ppm", "Da"].index(search_unit))
+
+        # Annotate the data: align the annotated peaks to the spectrum peaks by m/z
+        ion_labels, ion_codes = np.unique(CSM_details['anotarray'], return_inverse=True)
+        peak_codes = match_annotations(mz_full, CSM_details['mzarray'], ion_codes, tolerance, unit)
+        # code -1 (peak without annotation) takes the appended blank label
+        ion_labels = np.append(ion_labels, ' ')
+        annotation_data = {'mzarray': mz_full,
+            'intarray': inten_full,
+            'anotarray': ion_labels[peak_codes]
+        }
+
+    else:
+        annotation_data = annotation_data_idxml # just provide the annotated peaks
+
+    # Check if the lists are not empty
+    if annotation_data:
+        # Create the DataFrame
+        annotation_df = pd.DataFrame(annotation_data)
+        # title of spectra
+        spectra_name = os.path.splitext(selected_file)[0] +" Scan# " + str({selected_row[0]['ScanNr']}).strip('{}') + " Pep: " + str({selected_row[0]['Peptide']}).strip('{}\'') +  " + " +str ({selected_row[0]['NuXL:NA']}).strip('{}\'')
+        # m/z range to draw (zoom), the peaks are decimated on the server at this width
+        mz_min, mz_max = float(annotation_df["mzarray"].min()), float(annotation_df["mzarray"].max())
+        col_range, col_webgl = st.columns([4, 1])
+        mz_range = col_range.slider("m/z range", mz_min, mz_max, (mz_min, mz_max)) if mz_max > mz_min else None
+        # WebGL rendering for spectra with many (profile) peaks
+        webgl = col_webgl.toggle("WebGL", value=len(annotation_df) > 5000, help="render the spectrum with WebGL")
+        # generate ms2 spectra, cached by result file, CSM and everything else the figure depends on
+        figure_options = (spectra_name, webgl, mz_range, spectrum_peaks is not None and file_hash(Path(mzML_path)),
+                          spectrum_peaks is not None and (tolerance, unit))
+        fig = get_spectrum_figure(workspace_path / "result-files" /f"{selected_file}", selected_row[0]['SpecId'], figure_options,
+                                  lambda: plot_ms2_spectrum_full(annotation_df, spectra_name, "black", webgl=webgl, mz_range=mz_range))
+        #show figure
+        show_fig(fig,  f"{os.path.splitext(selected_file)[0]}_scan_{str({selected_row[0]['ScanNr']}).strip('{}')}")
+        # localization scores of the crosslink (loaded with the selected CSM only)
+        if CSM_details.get('NuXL:localization_scores'):
+            st.caption(f"Localization scores: {CSM_details['NuXL:localization_scores']}")
+
+    else:
+        # if any list empty
+        st.warning("Annotation not available for this peptide")
+
+@st.fragment
+def show_CSMs(selected_file):
     """
-    Extracts m/z values and corresponding intensities from an MS2 spectrum with a specified native ID.
+    Shows the CSM table of the selected result file, selecting a row only reruns this fragment (table and spectrum).
 
-    Parameters:
-    MS2_spectras (MSExperiment): An MSExperiment object containing MS2 spectra.
-    native_id (str): The native ID of the desired MS2 spectrum.
+    Args:
+        selected_file: selected idXML file name.
 
     Returns:
-    tuple: A tuple containing two arrays:
-        - mz (list): List of m/z values.
-        - intensities (list): List of corresponding intensity values.
+        None
+    """
+    #st.write("CSMs Table")
+    #the CSMs stay in the cached table (the idXML is only parsed once), only the shown page is converted and sent to the browser
+    CSM_path = workspace_path / "result-files" /f"{selected_file}"
+    CSM_columns = memoised("CSM-columns", CSM_path, lambda: get_CSM_columns(CSM_path))
+
+    ##TODO setup more better/effiecient
+    # Remove the out pattern of idxml
+    file_name_wout_out = remove_substrings(selected_file, nuxl_out_pattern)
+
+    if file_name_wout_out == "Example": 
+        file_name_wout_out = "Example_RNA_UV_XL"
+
+    mzML_path = os.path.join(Path.cwd().parent ,  str(st.session_state.workspace)[3:] , "mzML-files" ,f"{file_name_wout_out}.mzML")
+    # opened files and spectra are shared by all sessions, up to the configured memory budget
+    spectrum_cache = get_spectrum_cache(st.session_state.settings.get("spectrum_cache_mb", 512) * 1024 * 1024)
+    # random access to single spectra, the file is not loaded
+    MS2 = load_mzML_file(mzML_path, spectrum_cache)
+    if MS2 is None:
+        st.warning("The corresponding " + file_name_wout_out + ".mzML file could not be found. Please re-upload the mzML file to visualize all peaks.")
+
+    if CSM_columns is None: 
+        st.warning("No CSMs found in selected idXML file")
+    else:
+
+        # only the adduct column is read from the cached table
+        adducts = load_CSM_table(CSM_path, columns=["NuXL:NA"])
+        if "NuXL:NA" in adducts.columns and (adducts["NuXL:NA"] == "none").any():
+            st.warning("nonXL CSMs found")  
+        else:
+
+            # sorting, filtering and paging run on the cached table (server side), the grid only gets the rows of one page
+            col1, col2, col3, col4 = st.columns([3, 3, 2, 2])
+            with col1:
+                sort_by = st.selectbox("sort by", [""] + CSM_columns, key=f"CSM-sort-{selected_file}")
+                descending = st.toggle("descending", value=True, key=f"CSM-descending-{selected_file}")
+            with col2:
+                filter_column = st.selectbox("filter column", [""] + CSM_columns, key=f"CSM-filter-column-{selected_file}")
+                filter_expression = st.text_input("filter", placeholder="text, or e.g. <0.01 for numbers", key=f"CSM-filter-{selected_file}")
+            filters = {filter_column: filter_expression} if filter_column else None
+
+            with col3:
+                page_size = st.selectbox("rows per page", [10, 25, 50, 100], key=f"CSM-page-size-{selected_file}")
+
+            # number of CSMs passing the filter, sorting is only done once per query
+            try:
+                n_CSMs = query_CSM_table(CSM_path, page_size=0, sort_by=sort_by, ascending=not descending, filters=filters)[1]
+            except ValueError as e:
+                st.warning(str(e))
+                filters, n_CSMs = None, query_CSM_table(CSM_path, page_size=0)[1]
+            n_pages = max(1, -(-n_CSMs // page_size))
+
+            with col4:
+                page = st.number_input(f"page (of {n_pages})", min_value=1, max_value=n_pages, value=1, step=1, key=f"CSM-page-{selected_file}")
+            CSM_, _ = query_CSM_table(CSM_path, page=min(page, n_pages) - 1, page_size=page_size, sort_by=sort_by, ascending=not descending, filters=filters)
+            st.caption(f"{n_CSMs} CSMs")
+
+            # provide dataframe
+            gb = GridOptionsBuilder.from_dataframe(CSM_[list(CSM_.columns.values)])
+
+            # configure selection
+            gb.configure_selection(selection_mode="single", use_checkbox=True)
+            gb.configure_side_bar()
+            # the grid would only sort and filter the current page
+            gb.configure_default_column(sortable=False, filter=False)
+            gridOptions = gb.build()
+
+            data = AgGrid(CSM_,
+                        gridOptions=gridOptions,
+                        enable_enterprise_modules=True,
+                        allow_unsafe_jscode=True,
+                        update_mode=GridUpdateMode.SELECTION_CHANGED,
+                        columns_auto_size_mode=ColumnsAutoSizeMode.FIT_CONTENTS)
+
+            #download table, the whole table is only converted on request
+            if st.toggle("Download whole table", key=f"CSM-download-{selected_file}"):
+                download_table(load_CSM_table(CSM_path), f"{os.path.splitext(selected_file)[0]}")
+            #select row by user
+            selected_row = data["selected_rows"]
+
+            if selected_row:
+                show_spectrum(selected_file, selected_row, mzML_path, MS2, spectrum_cache)
+
+            # statistics of the shared spectrum cache
+            with st.expander("🐞 Spectrum cache"):
+                cache_stats = spectrum_cache.stats()
+                st.write(f"{cache_stats['entries']} entries, {cache_stats['size'] / 1024**2:.1f} of {cache_stats['max_bytes'] / 1024**2:.0f} MB, "
+                         f"{cache_stats['hits']} hits, {cache_stats['misses']} misses")
+
+@st.fragment
+def show_protein_section(protein_path, section):
+    """
+    Shows one section of the protein table, in its own fragment so downloads do not rerun the other tabs.
+
+    Args:
+        protein_path: path of the protein (.tsv) file.
+        section: section name: "PRTs_list", "PRTs_summary", "efficiency" or "adduct_summary".
 
-    If the specified native ID is not found, the function returns None.
+    Returns:
+        None
     """
-    # Iterate through all spectra in the provided MS2_spectras object
-    for spectrum in MS2_spectras.getSpectra():
-        # Check if the current spectrum's native ID matches the specified native ID
-        if spectrum.getNativeID() == native_id:
-            # Extract m/z values and corresponding intensities from the spectrum
-            mz, intensities = spectrum.get_peaks()
-            # Return the m/z values and intensities as a tuple
-            return mz, intensities
-    
-    # If the native ID is not found, return None
-    return None
+    new_filename = protein_path.name
+
+    if section == "PRTs_list":
+        #st.write("PRTs Table")
+        #take the protein list section only (sections are parsed when shown and cached per file)
+        #PRTs_List; shown on page with download button
+        show_table(read_protein_section(protein_path, "PRTs_list"), f"{os.path.splitext(new_filename)[0]}_PRTS_list")
+
+    elif section == "PRTs_summary":
+        #st.write("Protein summary")
+        #PRTs_summary section; shown on page with download button
+        show_table(read_protein_section(protein_path, "PRTs_summary"), f"{os.path.splitext(new_filename)[0]}_PRTS_summary")
+
+    elif section == "efficiency":
+        #st.write("Crosslink efficiency (AA freq. / AA freq. in all CSMs)")
+        #crosslink efficiency section
+        prts_efficiency = read_protein_section(protein_path, "efficiency")
+
+        #create crosslink efficiency plot
+        efficiency_fig = go.Figure(data=[go.Bar(x=prts_efficiency["AA"], y=prts_efficiency["Crosslink efficiency"], marker_color='rgb(55, 83, 109)')])
+        #update the layout of plot
+        efficiency_fig.update_layout(
+            #title='Crosslink efficiency',
+            xaxis_title='Amino acids',
+            yaxis_title='Crosslink efficiency (AA freq. / AA freq. in all CSMs)',
+            font=dict(family='Arial', size=12, color='rgb(0,0,0)'),
+            paper_bgcolor='rgb(255, 255, 255)',
+            plot_bgcolor='rgb(255, 255, 255)'
+        )
+        #show figure, with download
+        show_fig(efficiency_fig, f"{os.path.splitext(new_filename)[0]}_efficiency")
+        #show button of download table from where above plot came
+        download_table(prts_efficiency, f"{os.path.splitext(new_filename)[0]}_efficiency")
+
+    elif section == "adduct_summary":
+        #st.write("Precursor adduct summary")
+        #show_table(PRTs_section[4])
+        #precursor adduct summary section
+        precursor_summary = read_protein_section(protein_path, "adduct_summary")
+
+        #create mass adducts efficiency plot
+        adducts_fig = go.Figure(data=[go.Pie(
+            labels=precursor_summary["Precursor adduct:"],
+            values=precursor_summary["PSMs(%)"],
+            hoverinfo='label+percent',
+            textinfo='label+percent',
+            #title='Percentage of PSMs for Each Index Precursor'
+        )])
+
+        #show figure, with download
+        show_fig(adducts_fig , f"{os.path.splitext(new_filename)[0]}_adduct_summary")
+        #show button of download table from where above plot came
+        download_table(precursor_summary, f"{os.path.splitext(new_filename)[0]}_adduct_summary")
+
+@st.fragment
+def show_query():
+    """
+    Shows a SQL query box over all result files of the workspace (CSMs and protein tables), 
+    the CSMs are scanned from the cached tables without loading them.
 
-def remove_substrings(original_string, substrings_to_remove):
-    modified_string = original_string
-    for substring in substrings_to_remove:
-        modified_string = modified_string.replace(substring, "")
-    return modified_string
+    Returns:
+        None
+    """
+    if not DUCKDB_AVAILABLE:
+        st.info("SQL queries need the duckdb package, install it with: pip install duckdb")
+        return
+
+    # available tables and their columns
+    with st.expander("Tables"):
+        for table, columns in list_tables(st.session_state.workspace).items():
+            st.markdown(f"**{table}**: " + ", ".join(f"`{c}`" for c in columns))
+
+    sql = st.text_area("SQL query", EXAMPLE_QUERY, height=150, key="result-query")
+    max_rows = st.number_input("maximum rows", min_value=1, value=10000, step=1000, key="result-query-rows")
+
+    if st.button("Run query", type="primary"):
+        try:
+            query_result = run_query(st.session_state.workspace, sql, max_rows=max_rows,
+                                     memory_limit_mb=st.session_state.settings.get("query_memory_mb"))
+        except Exception as e:
+            st.error(f"Query failed: {e}")
+        else:
+            if query_result is None:
+                st.success("Query done")
+            else:
+                show_table(query_result, "query_result")
 
-nuxl_out_pattern = ["_perc_0.0100_XLs.idXML", "_0.0100_XLs.idXML", "_perc_0.1000_XLs.idXML", "_0.1000_XLs.idXML", "_perc_1.0000_XLs.idXML", "_1.0000_XLs.idXML"]
+@st.fragment
+def show_result_files():
+    """
+    Shows the result files of the workspace with remove and download options.
+
+    Returns:
+        None
+    """
+    #make sure to load all results example files
+    load_example_result_files()
+
+    if any(Path(result_dir).iterdir()):
+        v_space(2)
+        #  all result files currently in workspace
+        df = pd.DataFrame(
+            {"file name": [f.name for f in Path(result_dir).iterdir()]})
+        st.markdown("##### result files in current workspace:")
+
+        show_table(df)
+        v_space(1)
+        # Remove files
+        copy_local_result_files_from_directory(result_dir)
+        with st.expander("🗑️ Remove result files"):
+            #take all example result files name
+            list_result_examples = list_result_example_files()
+            #take all session result files
+            session_files = [f.name for f in sorted(result_dir.iterdir())]
+            #filter out the example result files
+            Final_list = [item for item in session_files if item not in list_result_examples]
+
+            #multiselect for result files selection
+            to_remove = st.multiselect("select result files", options=Final_list)
+
+            c1, c2 = st.columns(2)
+            ### remove selected files from workspace
+            if c2.button("Remove **selected**", type="primary", disabled=not any(to_remove)):
+                remove_selected_result_files(to_remove)
+                st.rerun() 
+
+            ### remove all files from workspace
+            if c1.button("⚠️ Remove **all**", disabled=not any(result_dir.iterdir())):
+                remove_all_result_files() 
+                st.rerun() 
+
+
+        with st.expander("⬇️ Download result files"):
+            #multiselect for result files selection
+            to_download = st.multiselect("select result files for download",
+                                    options=[f.name for f in sorted(result_dir.iterdir())])
+
+            c1, c2 = st.columns(2)
+            if c2.button("Download **selected**", type="primary", disabled=not any(to_download)):
+                #download selected files will display download hyperlink
+                download_selected_result_files(to_download, "selected_result_files")
+                #st.rerun()
+
+            ### afraid if there are many files in workspace? should we removed this option?
+            if c1.button("⚠️ Download **all**", disabled=not any(result_dir.iterdir())):
+                #create the zip content of all result files in workspace
+                b64_zip_content = create_zip_and_get_base64_()
+                #display the download hyperlink
+                href = f'<a href="data:application/zip;base64,{b64_zip_content}" download="all_result_files.zip">Download All Files</a>'
+                st.markdown(href, unsafe_allow_html=True)
+
+@st.fragment
+def show_upload_result_files():
+    """
+    Shows the upload form of result files.
+
+    Returns:
+        None
+    """
+    #form to upload file
+    with st.form("Upload .idXML and .tsv", clear_on_submit=True):
+        files = st.file_uploader(
+            "NuXL result files", accept_multiple_files=(st.session_state.location == "local"), type=['.idXML', '.tsv'], help="Input file (Valid formats: 'idXML', 'tsv') should be _XLs output file")
+        cols = st.columns(3)
+        if cols[1].form_submit_button("Add files to workspace", type="primary"):
+            if not files:
+                st.warning("Upload some files first.")
+            else:
+                save_uploaded_result(files)
+            st.rerun()
 
 ########################
 
@@ -107,12 +434,15 @@ result_dir: Path = Path(st.session_state.workspace, "result-files")
 #title of page
 st.title("📊 Result Viewer")
 
-#tabs on page
-tabs = ["View Results", "Result files", "Upload result files"]
-tabs = st.tabs(tabs)
+#views on page, unlike st.tabs only the content of the selected view is computed
+page_views = ["View Results", "SQL query", "Result files", "Upload result files"]
+#SQL queries run on the server, they are offered in local installations only
+if st.session_state.settings["online_deployment"]:
+    page_views.remove("SQL query")
+page_view = st.radio("view", page_views, horizontal=True, label_visibility="collapsed", key="result-page-view")
 
-#with View Results tab
-with tabs[0]:  
+#with View Results view
+if page_view == "View Results":
 
     #make sure load all example result files
     load_example_result_files()
@@ -121,110 +451,32 @@ with tabs[0]:
     # select box to select .idXML file to see the results
     selected_file = st.selectbox("choose a currently protocol file to view",session_files)
 
+    # merge the CSMs of several result files (e.g. the fractions of a study) into one table
+    with st.expander("🔗 Merge CSMs of several result files"):
+        merge_files = st.multiselect("choose result files to merge", session_files)
+        if len(merge_files) > 1:
+            # files are converted in parallel, a "run" column names the file of each CSM
+            merged_CSMs = load_CSM_tables([Path(st.session_state.workspace, "result-files", f) for f in merge_files])
+            if merged_CSMs is None:
+                st.warning("No CSMs found in selected idXML files")
+            else:
+                show_table(merged_CSMs, "merged_CSMs")
+
     #current workspace session path
     workspace_path = Path(st.session_state.workspace)
-    #tabs on page to show different results
-    tabs_ = st.tabs(["CSMs Table", "PRTs Table", "PRTs Summary", "Crosslink efficiency", "Precursor adducts summary"])
+    #views to show different results, only the selected one is computed (protein summaries never parse the CSMs)
+    result_views = {"CSMs Table": None, "PRTs Table": "PRTs_list", "PRTs Summary": "PRTs_summary",
+                    "Crosslink efficiency": "efficiency", "Precursor adducts summary": "adduct_summary"}
+    result_view = st.radio("result view", list(result_views), horizontal=True, label_visibility="collapsed", key="result-view")
 
     ## selected .idXML file
     if selected_file:
         #with CSMs Table
-        with tabs_[0]:
-            #st.write("CSMs Table")
-            #take all CSMs as dataframe
-            CSM_= readAndProcessIdXML(workspace_path / "result-files" /f"{selected_file}")
-
-            ##TODO setup more better/effiecient
-            # Remove the out pattern of idxml
-            file_name_wout_out = remove_substrings(selected_file, nuxl_out_pattern)
-
-            if file_name_wout_out == "Example": 
-                file_name_wout_out = "Example_RNA_UV_XL"
+        if result_view == "CSMs Table":
+            show_CSMs(selected_file)
 
-            MS2 = process_mzML_file(os.path.join(Path.cwd().parent ,  str(st.session_state.workspace)[3:] , "mzML-files" ,f"{file_name_wout_out}.mzML"))
-            if MS2 is None:
-                st.warning("The corresponding " + file_name_wout_out + ".mzML file could not be found. Please re-upload the mzML file to visualize all peaks.")
-                            
-            if CSM_ is None: 
-                st.warning("No CSMs found in selected idXML file")
-            else:
-                
-                if CSM_['NuXL:NA'].str.contains('none').any():
-                    st.warning("nonXL CSMs found")  
-                else:
-                
-                    # provide dataframe
-                    gb = GridOptionsBuilder.from_dataframe(CSM_[list(CSM_.columns.values)])
-
-                    # configure selection
-                    gb.configure_selection(selection_mode="single", use_checkbox=True)
-                    gb.configure_side_bar()
-                    gb.configure_pagination(enabled=True, paginationAutoPageSize=False, paginationPageSize=10)
-                    gridOptions = gb.build()
-                    
-                    data = AgGrid(CSM_,
-                                gridOptions=gridOptions,
-                                enable_enterprise_modules=True,
-                                allow_unsafe_jscode=True,
-                                update_mode=GridUpdateMode.SELECTION_CHANGED,
-                                columns_auto_size_mode=ColumnsAutoSizeMode.FIT_CONTENTS)
-
-                    #download table
-                    download_table(CSM_, f"{os.path.splitext(selected_file)[0]}")
-                    #select row by user
-                    selected_row = data["selected_rows"]
-
-                    if selected_row:
-                        # Create a dictionary of annotation features
-                        annotation_data_idxml = {'intarray': [float(value) for value in {selected_row[0]['intensities']}.pop().split(',')],
-                                'mzarray': [float(value) for value in {selected_row[0]['mz_values']}.pop().split(',')],
-                                'anotarray': [str(value) for value in {selected_row[0]['ions']}.pop().split(',')]
-                            }
-                        
-                        #annotation_data_idxml_df = pd.DataFrame(annotation_data_idxml)
-                        #annotation_data_idxml_df.to_csv(str(selected_row[0]['ScanNr']) + "_idxml_annot.csv")
-                            
-                        if MS2 is not None:
-                            # Extract m/z and intensity data from the selected MS2 spectrum
-                            mz_full, inten_full = get_mz_intensities_from_ms2(MS2_spectras=MS2, native_id=selected_row[0]['SpecId'])
-
-                            # Convert annotation_data into a dictionary for efficient matching
-                            annotation_dict = {(round(mz, 6), round(i, 6)): anot for i, mz, anot in zip(annotation_data_idxml['intarray'], annotation_data_idxml['mzarray'], annotation_data_idxml['anotarray'])}
-                            
-                            # Annotate the data
-                            annotation_data = []
-                            for intensity, mz in zip(inten_full, mz_full):
-                                mz_r = round(float(mz), 6)
-                                int_r = round(float(intensity), 6)
-
-                                annotation = annotation_dict.get((mz_r, int_r), ' ')
-
-                                annotation_data.append({
-                                    'mzarray': mz_r,
-                                    'intarray': int_r,
-                                    'anotarray': annotation
-                                }) 
-                        
-                        if MS2 is None:
-                            annotation_data = annotation_data_idxml # just provide the annotated peaks
- 
-                        # Check if the lists are not empty
-                        if annotation_data:
-                            # Create the DataFrame
-                            annotation_df = pd.DataFrame(annotation_data)
-                            # title of spectra
-                            spectra_name = os.path.splitext(selected_file)[0] +" Scan# " + str({selected_row[0]['ScanNr']}).strip('{}') + " Pep: " + str({selected_row[0]['Peptide']}).strip('{}\'') +  " + " +str ({selected_row[0]['NuXL:NA']}).strip('{}\'')
-                            # generate ms2 spectra
-                            fig = plot_ms2_spectrum_full(annotation_df, spectra_name, "black")
-                            #show figure
-                            show_fig(fig,  f"{os.path.splitext(selected_file)[0]}_scan_{str({selected_row[0]['ScanNr']}).strip('{}')}")
-
-                        else:
-                            # if any list empty
-                            st.warning("Annotation not available for this peptide")
-                                
-        #with PRTs Table
-        with tabs_[1]:
+        #with the protein views
+        else:
             # Extracting components from the input filename to show the result of corresponding proteins file
             parts = selected_file.split('_')
             prefix = '_'.join(parts[:-2])  # Joining all parts except the last two
@@ -238,60 +490,8 @@ with tabs[0]:
 
             #if file exist
             if protein_path.exists():
-                #st.write("PRTs Table")
-                #take list of dataframs different results 
-                PRTs_section= read_protein_table(protein_path)
-                #from 1st dataframe PRTs_List; shown on page with download button
-                show_table(PRTs_section[0], f"{os.path.splitext(new_filename)[0]}_PRTS_list")
-            
-                #with PRTs Summary
-                with tabs_[2]:       
-                        #st.write("Protein summary")
-                        #from wnd dataframe PRTs_summary; shown on page with download button
-                        show_table(PRTs_section[2], f"{os.path.splitext(new_filename)[0]}_PRTS_summary")
-                
-                #with Crosslink efficiency
-                with tabs_[3]:
-                        #st.write("Crosslink efficiency (AA freq. / AA freq. in all CSMs)")
-                        #from 3rd dataframe PRTs_efficiency
-                        prts_efficiency = PRTs_section[3]
-
-                        #create crosslink efficiency plot
-                        efficiency_fig = go.Figure(data=[go.Bar(x=prts_efficiency["AA"], y=prts_efficiency["Crosslink efficiency"], marker_color='rgb(55, 83, 109)')])
-                        #update the layout of plot
-                        efficiency_fig.update_layout(
-                            #title='Crosslink efficiency',
-                            xaxis_title='Amino acids',
-                            yaxis_title='Crosslink efficiency (AA freq. / AA freq. in all CSMs)',
-                            font=dict(family='Arial', size=12, color='rgb(0,0,0)'),
-                            paper_bgcolor='rgb(255, 255, 255)',
-                            plot_bgcolor='rgb(255, 255, 255)'
-                        )
-                        #show figure, with download
-                        show_fig(efficiency_fig, f"{os.path.splitext(new_filename)[0]}_efficiency")
-                        #show button of download table from where above plot came
-                        download_table(prts_efficiency, f"{os.path.splitext(new_filename)[0]}_efficiency")
-
-                #with Precursor adducts summary
-                with tabs_[4]:
-                            #st.write("Precursor adduct summary")
-                            #show_table(PRTs_section[4])
-                            #from 4th dataframe mass_adducts efficiency
-                            precursor_summary = PRTs_section[4]
-
-                            #create mass adducts efficiency plot
-                            adducts_fig = go.Figure(data=[go.Pie(
-                                labels=precursor_summary["Precursor adduct:"],
-                                values=precursor_summary["PSMs(%)"],
-                                hoverinfo='label+percent',
-                                textinfo='label+percent',
-                                #title='Percentage of PSMs for Each Index Precursor'
-                            )])
-
-                            #show figure, with download
-                            show_fig(adducts_fig , f"{os.path.splitext(new_filename)[0]}_adduct_summary")
-                            #show button of download table from where above plot came
-                            download_table(precursor_summary, f"{os.path.splitext(new_filename)[0]}_adduct_summary")
+                #only the section of the selected view is read
+                show_protein_section(protein_path, result_views[result_view])
 
             #if the same protein file not available
             else:
@@ -370,77 +570,17 @@ with tabs[0]:
             else:
                 st.warning(f"{protein_path.name} file not exist in current workspace")
             """
-#with "Result files" 
-with tabs[1]:
-    #make sure to load all results example files
-    load_example_result_files()
-
-    if any(Path(result_dir).iterdir()):
-        v_space(2)
-        #  all result files currently in workspace
-        df = pd.DataFrame(
-            {"file name": [f.name for f in Path(result_dir).iterdir()]})
-        st.markdown("##### result files in current workspace:")
+#with "SQL query"
+elif page_view == "SQL query":
+    show_query()
 
-        show_table(df)
-        v_space(1)
-        # Remove files
-        copy_local_result_files_from_directory(result_dir)
-        with st.expander("🗑️ Remove result files"):
-            #take all example result files name
-            list_result_examples = list_result_example_files()
-            #take all session result files
-            session_files = [f.name for f in sorted(result_dir.iterdir())]
-            #filter out the example result files
-            Final_list = [item for item in session_files if item not in list_result_examples]
-
-            #multiselect for result files selection
-            to_remove = st.multiselect("select result files", options=Final_list)
-
-            c1, c2 = st.columns(2)
-            ### remove selected files from workspace
-            if c2.button("Remove **selected**", type="primary", disabled=not any(to_remove)):
-                remove_selected_result_files(to_remove)
-                st.rerun() 
-
-            ### remove all files from workspace
-            if c1.button("⚠️ Remove **all**", disabled=not any(result_dir.iterdir())):
-                remove_all_result_files() 
-                st.rerun() 
-
-
-        with st.expander("⬇️ Download result files"):
-            #multiselect for result files selection
-            to_download = st.multiselect("select result files for download",
-                                    options=[f.name for f in sorted(result_dir.iterdir())])
-            
-            c1, c2 = st.columns(2)
-            if c2.button("Download **selected**", type="primary", disabled=not any(to_download)):
-                #download selected files will display download hyperlink
-                download_selected_result_files(to_download, "selected_result_files")
-                #st.rerun()
-
-            ### afraid if there are many files in workspace? should we removed this option?
-            if c1.button("⚠️ Download **all**", disabled=not any(result_dir.iterdir())):
-                #create the zip content of all result files in workspace
-                b64_zip_content = create_zip_and_get_base64_()
-                #display the download hyperlink
-                href = f'<a href="data:application/zip;base64,{b64_zip_content}" download="all_result_files.zip">Download All Files</a>'
-                st.markdown(href, unsafe_allow_html=True)
+#with "Result files" 
+elif page_view == "Result files":
+    show_result_files()
 
 #with "Upload result files"
-with tabs[2]:
-    #form to upload file
-    with st.form("Upload .idXML and .tsv", clear_on_submit=True):
-        files = st.file_uploader(
-            "NuXL result files", accept_multiple_files=(st.session_state.location == "local"), type=['.idXML', '.tsv'], help="Input file (Valid formats: 'idXML', 'tsv') should be _XLs output file")
-        cols = st.columns(3)
-        if cols[1].form_submit_button("Add files to workspace", type="primary"):
-            if not files:
-                st.warning("Upload some files first.")
-            else:
-                save_uploaded_result(files)
-            st.rerun()
+else:
+    show_upload_result_files()
 
 # At the end of each page, always save parameters (including any changes via widgets with key)
 save_params(params)
@@ -1,6 +1,16 @@
+import sys
+import multiprocessing
 from streamlit.web import cli
 
 if __name__=='__main__':
+    # worker processes (parallel result file conversion) re-enter the frozen executable
+    multiprocessing.freeze_support()
+
+    # background search jobs re-enter the frozen executable (see src/jobs.py)
+    if len(sys.argv) > 2 and sys.argv[1] == "--job":
+        from src.jobs import run_job
+        run_job(sys.argv[2])
+        sys.exit()
     
     cli._main_run_clExplicit(file = 'app.py', command_line = 'streamlit run', args=['local']) #run in local mode
     # we will create this function inside our streamlit framework
@@ -4,6 +4,7 @@ import shutil
 import sys
 import uuid
 import time
+import hashlib
 from typing import Any
 from pathlib import Path
 from streamlit.components.v1 import html
@@ -230,6 +231,9 @@ def page_setup(page: str = "") -> dict[str, Any]:
     
     Path(st.session_state.workspace,
          "result-files").mkdir(parents=True, exist_ok=True)
+
+    Path(st.session_state.workspace,
+         "cache-files").mkdir(parents=True, exist_ok=True)
     
     # Render the sidebar
     params = render_sidebar(page)
@@ -562,6 +566,33 @@ def reset_directory(path: Path) -> None:
         shutil.rmtree(path)
     path.mkdir(parents=True, exist_ok=True)
 
+# content hashes of already seen files, keyed by (path, size, modification time)
+_FILE_HASHES: dict[tuple, str] = {}
+
+def file_hash(path: Path) -> str:
+    """
+    Calculate the content hash (sha256) of a file.
+
+    The hash is remembered per path, size and modification time, so a file is only read again if it changed.
+
+    Args:
+        path (Path): Path to the file.
+
+    Returns:
+        str: Hex digest of the file content.
+    """
+    path = Path(path)
+    stat = path.stat()
+    key = (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+    if key not in _FILE_HASHES:
+        sha = hashlib.sha256()
+        # read in chunks, result files can be several GB
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        _FILE_HASHES[key] = sha.hexdigest()
+    return _FILE_HASHES[key]
+
 # General warning/error messages
 WARNINGS = {
     "missing-mzML": "Upload or select some mzML files first!",
@@ -3,6 +3,7 @@ from pathlib import Path
 import streamlit as st
 
 from src.common import reset_directory
+from src.spectra import build_spectrum_store
 
 def add_to_selected_mzML(filename: str):
     """
@@ -44,6 +45,10 @@ def save_uploaded_mzML(uploaded_files: list[bytes]) -> None:
         if f.name not in [f.name for f in mzML_dir.iterdir()] and (f.name.endswith("mzML") or f.name.endswith("raw")):
             with open(Path(mzML_dir, f.name), "wb") as fh:
                 fh.write(f.getbuffer())
+            # extract the MS2 spectra into the memory-mapped spectrum store for viewing
+            if f.name.endswith("mzML"):
+                with st.spinner(f"Preparing spectra of {f.name}..."):
+                    build_spectrum_store(Path(mzML_dir, f.name))
         add_to_selected_mzML(Path(f.name).stem)
     st.success("Successfully added uploaded files!")
 
@@ -71,6 +76,8 @@ def copy_local_mzML_files_from_directory(local_mzML_directory: str) -> None:
     for f in files:
         if f.name not in mzML_dir.iterdir():
             shutil.copy(f, mzML_dir)
+            # extract the MS2 spectra into the memory-mapped spectrum store for viewing
+            build_spectrum_store(Path(mzML_dir, f.name))
         add_to_selected_mzML(f.stem)
     st.success("Successfully added local files!")
 
@@ -89,6 +96,8 @@ def load_example_mzML_files() -> None:
     mzML_dir: Path = Path(st.session_state.workspace, "mzML-files")
     for f in Path("example-data", "mzML").glob("*.mzML"):
         shutil.copy(f, mzML_dir)
+        # extract the MS2 spectra into the memory-mapped spectrum store for viewing
+        build_spectrum_store(Path(mzML_dir, f.name))
         add_to_selected_mzML(f.stem)
     #st.success("Example mzML files loaded!")
 
@@ -104,9 +113,14 @@ def remove_selected_mzML_files(to_remove: list[str]) -> None:
     """
     mzML_dir: Path = Path(st.session_state.workspace, "mzML-files")
 
+    cache_dir: Path = Path(st.session_state.workspace, "cache-files")
+
     # remove all given files from mzML workspace directory and selected files
     for f in to_remove:
         Path(mzML_dir, f).unlink()
+        # remove the spectrum indices and stores of the file
+        for cached in cache_dir.glob(f"{f}.*"):
+            shutil.rmtree(cached) if cached.is_dir() else cached.unlink()
         #st.code(st.session_state["selected-mzML-files"])
         #st.session_state["selected-mzML-files"].remove(f)
     st.success("Selected mzML files removed!")
@@ -124,6 +138,10 @@ def remove_all_mzML_files() -> None:
     """
     mzML_dir: Path = Path(st.session_state.workspace, "mzML-files")
 
+    # remove the spectrum indices and stores of all mzML files
+    for f in mzML_dir.iterdir():
+        for cached in Path(st.session_state.workspace, "cache-files").glob(f"{f.name}.*"):
+            shutil.rmtree(cached) if cached.is_dir() else cached.unlink()
     # reset (delete and re-create) mzML directory in workspace
     reset_directory(mzML_dir)
     # reset selected mzML list
@@ -0,0 +1,682 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import shutil
+import signal
+import tempfile
+import subprocess
+from pathlib import Path
+from contextlib import contextmanager
+from src.search_cache import search_cache_key, store_search_result, restore_search_result
+
+###################################### background jobs (OpenNuXL searches) ##################################
+
+# a job is a directory in the "jobs" directory of the workspace with the job state in job.json,
+# it is run by a detached worker process (python -m src.jobs <job dir>), which outlives reruns,
+# browser refreshes and closed tabs; the worker writes the job state while it runs, the pages write it
+# only for jobs whose worker is gone (failed or cancelled), all changes hold the lock of the job (job_lock)
+
+# states of a job
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+# states of jobs which are not finished
+ACTIVE_JOB_STATES = (JOB_QUEUED, JOB_RUNNING)
+
+# seconds between two checks of a queued job for free cores and memory
+SCHEDULER_INTERVAL = 2
+
+# a scheduler lock older than this (seconds) was left by a killed worker
+STALE_LOCK_AGE = 60
+
+# seconds a cancelled search gets to exit after SIGTERM, then it is killed
+CANCEL_GRACE_PERIOD = 10
+
+# outputs of a search with -out <prefix>.idXML are named <prefix><suffix>: <prefix>.idXML, <prefix>_0.0100_XLs.idXML,
+# <prefix>_perc_proteins0.0100_XLs.tsv, ..., and the log and ambiguous masses moved there after the search;
+# the suffix tells them apart from the outputs of other searches with the same prefix (e.g. s_1 and s_10)
+OUTPUT_SUFFIX = re.compile(r"(_perc)?(_proteins\d+\.\d+|_\d+\.\d+)?(_XLs|_peptides)?\.\w+|_log\.txt|\.mzML\.ambigious_masses\.csv")
+
+def get_jobs_dir(workspace: Path) -> Path:
+    """
+    Get the directory with the jobs of a workspace.
+
+    Args:
+        workspace (Path): workspace directory.
+
+    Returns:
+        Path: The jobs directory (created if not existing).
+    """
+    jobs_dir = Path(workspace, "jobs")
+    jobs_dir.mkdir(parents=True, exist_ok=True)
+    return jobs_dir
+
+def read_job(job_dir: Path) -> dict:
+    """
+    Read the state of a job.
+
+    Args:
+        job_dir (Path): job directory.
+
+    Returns:
+        dict: the job state, None if the job does not exist (anymore)
+    """
+    try:
+        with open(Path(job_dir, "job.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def write_job(job_dir: Path, job: dict) -> None:
+    """
+    Write the state of a job, the file is replaced at once, so readers never see a half written state.
+
+    Args:
+        job_dir (Path): job directory.
+        job (dict): the job state.
+
+    Returns:
+        None
+    """
+    # the temporary file name is unique, sessions of the pages are threads of one process
+    fd, tmp_path = tempfile.mkstemp(dir=job_dir, prefix="job.json.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(job, f, indent=4)
+        os.replace(tmp_path, Path(job_dir, "job.json"))
+    finally:
+        Path(tmp_path).unlink(missing_ok=True)
+
+@contextmanager
+def directory_lock(lock_dir: Path):
+    """
+    Hold a lock between processes. The lock is a directory, creating it is atomic on all platforms.
+
+    Args:
+        lock_dir (Path): the lock directory, existing while the lock is held.
+
+    Returns:
+        None
+    """
+    while True:
+        try:
+            lock_dir.mkdir()
+            break
+        except FileExistsError:
+            try:
+                if time.time() - lock_dir.stat().st_mtime > STALE_LOCK_AGE:
+                    lock_dir.rmdir()
+            except OSError:
+                pass
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        lock_dir.rmdir()
+
+def job_lock(job_dir: Path):
+    """
+    Lock the state of a job, the worker and the pages never change it at the same time.
+
+    Args:
+        job_dir (Path): job directory.
+
+    Returns:
+        the lock (context manager)
+    """
+    return directory_lock(Path(job_dir, "job.lock"))
+
+def update_job(job_dir: Path, only_if_active: bool = False, **changes) -> dict:
+    """
+    Change fields of the state of a job (read, change and write while holding the lock of the job).
+
+    Args:
+        job_dir (Path): job directory.
+        only_if_active (bool): change the state only if the job is queued or running. Defaults to False.
+        **changes: the changed fields.
+
+    Returns:
+        dict: the new job state
+    """
+    with job_lock(job_dir):
+        job = read_job(job_dir)
+        if only_if_active and job["status"] not in ACTIVE_JOB_STATES:
+            return job
+        job.update(changes)
+        write_job(job_dir, job)
+    return job
+
+def pid_alive(pid: int) -> bool:
+    """
+    Check if a process is running.
+
+    Args:
+        pid (int): process id.
+
+    Returns:
+        bool: True if the process is running
+    """
+    if not pid:
+        return False
+
+    if sys.platform == "win32":
+        import ctypes
+        # PROCESS_QUERY_LIMITED_INFORMATION
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        ctypes.windll.kernel32.CloseHandle(handle)
+        # STILL_ACTIVE
+        return exit_code.value == 259
+
+    # workers started by this process are reaped here, otherwise they stay as zombies
+    try:
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
+            return False
+    except ChildProcessError:
+        pass
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def new_process_group() -> dict:
+    """
+    Get the subprocess.Popen arguments starting a process in its own process group, which can be
+    signalled as a whole (the process and all processes it starts), see signal_process_group.
+
+    Returns:
+        dict: the Popen arguments
+    """
+    if sys.platform == "win32":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+def signal_process_group(pid: int, kill: bool = False) -> None:
+    """
+    Terminate a process and all processes it started (e.g. OpenNuXL and its Percolator and
+    ThermoRawFileParser processes), the process must be started with new_process_group.
+
+    Args:
+        pid (int): process id of the process (leader of the process group).
+        kill (bool): kill (SIGKILL) instead of asking to terminate (SIGTERM). Defaults to False.
+
+    Returns:
+        None
+    """
+    if sys.platform == "win32":
+        # the process tree, forced when killing
+        subprocess.run(["taskkill", "/T"] + (["/F"] if kill else []) + ["/PID", str(pid)],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return
+    try:
+        os.killpg(pid, signal.SIGKILL if kill else signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        # the process group is gone already
+        pass
+
+def worker_command(job_dir: Path) -> list[str]:
+    """
+    Get the command starting the worker process of a job.
+
+    Args:
+        job_dir (Path): job directory.
+
+    Returns:
+        list[str]: the command
+    """
+    if getattr(sys, "frozen", False):
+        # the frozen app executable dispatches to run_job (see run_app.py)
+        return [sys.executable, "--job", str(job_dir)]
+    return [sys.executable, "-m", "src.jobs", str(job_dir)]
+
+def search_resources(n_searches: int, max_cores: int = 0, memory_budget_mb: int = 0, memory_per_job_mb: int = 0) -> tuple[int, int]:
+    """
+    Plan the resources of a batch of searches: how many run at once and how many threads each gets.
+
+    As many searches run at once as cores and memory allow, the cores are split evenly among them,
+    so the wall time of the batch approaches the total CPU time divided by the cores.
+
+    Args:
+        n_searches (int): number of searches in the batch.
+        max_cores (int): cores to use. Defaults to 0, all cores of the machine.
+        memory_budget_mb (int): memory of all searches running at once. Defaults to 0, no limit.
+        memory_per_job_mb (int): memory of one search. Defaults to 0, no limit.
+
+    Returns:
+        tuple[int, int]: number of concurrent searches, threads per search
+    """
+    cores = max_cores or os.cpu_count() or 1
+    concurrency = min(n_searches, cores)
+    if memory_budget_mb and memory_per_job_mb:
+        concurrency = min(concurrency, memory_budget_mb // memory_per_job_mb)
+    concurrency = max(1, concurrency)
+    return concurrency, max(1, cores // concurrency)
+
+def submit_job(workspace: Path, args: list[str], name: str, threads: int = 1, memory_mb: int = 0,
+               max_cores: int = 0, memory_budget_mb: int = 0, cache_mb: int = 0) -> dict:
+    """
+    Submit a job: write its state and start a detached worker process running it.
+
+    The job waits (queued) until its threads and memory are free, see can_start_job.
+    If the same search (same input file contents and settings) is in the search cache, the worker
+    copies its results into the result directory instead of searching, see run_job.
+
+    Args:
+        workspace (Path): workspace directory (the results are written to its "result-files" directory).
+        args (list[str]): The command and its arguments as a list of strings.
+        name (str): name of the job, the protocol name (mzML file name without extension).
+        threads (int): threads used by the job. Defaults to 1.
+        memory_mb (int): memory used by the job. Defaults to 0, not limited.
+        max_cores (int): cores of all running jobs. Defaults to 0, all cores of the machine.
+        memory_budget_mb (int): memory of all running jobs. Defaults to 0, no limit.
+        cache_mb (int): size limit of the search cache (MB). Defaults to 0, the cache is not used.
+
+    Returns:
+        dict: the job state
+    """
+    job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    job_dir = Path(get_jobs_dir(workspace), job_id)
+    job_dir.mkdir()
+
+    job = {
+        "id": job_id,
+        "name": name,
+        "status": JOB_QUEUED,
+        "args": [str(a) for a in args],
+        # its outputs are named after the -out file (see get_job_outputs)
+        "out": str(args[args.index("-out") + 1]) if "-out" in args else None,
+        # relative paths (e.g. of the workspace) are resolved by the worker like here
+        "cwd": os.getcwd(),
+        "workspace": str(workspace),
+        "pid": None,
+        "worker_pid": None,
+        "returncode": None,
+        "error": None,
+        "threads": threads,
+        "memory_mb": memory_mb,
+        "max_cores": max_cores or os.cpu_count() or 1,
+        "memory_budget_mb": memory_budget_mb,
+        # set by the worker, hashing the input files takes a while
+        "cache_key": None,
+        "cache_mb": cache_mb,
+        "cached": False,
+        "created": time.time(),
+        "started": None,
+        "finished": None,
+    }
+
+    write_job(job_dir, job)
+
+    # the worker gets its own session (process group), it is not stopped with the streamlit server session
+    detach = new_process_group()
+    if sys.platform == "win32":
+        detach["creationflags"] |= subprocess.DETACHED_PROCESS
+    worker = subprocess.Popen(worker_command(job_dir), cwd=os.getcwd(), stdin=subprocess.DEVNULL,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **detach)
+
+    # the worker writes the job state from now on, the pid is kept aside until it does
+    Path(job_dir, "worker.pid").write_text(str(worker.pid))
+    return job
+
+def get_worker_pid(job_dir: Path, job: dict) -> int:
+    """
+    Get the process id of the worker of a job.
+
+    Args:
+        job_dir (Path): job directory.
+        job (dict): the job state.
+
+    Returns:
+        int: the process id, None if the worker is not started yet
+    """
+    if job["worker_pid"]:
+        return job["worker_pid"]
+    try:
+        return int(Path(job_dir, "worker.pid").read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+def list_jobs(workspace: Path) -> list[dict]:
+    """
+    Get the states of all jobs of a workspace, newest first.
+
+    Jobs whose worker process is gone without finishing them (e.g. the machine restarted) are marked failed.
+
+    Args:
+        workspace (Path): workspace directory.
+
+    Returns:
+        list[dict]: the job states
+    """
+    jobs = []
+    for job_dir in sorted(get_jobs_dir(workspace).iterdir(), reverse=True):
+        job = read_job(job_dir)
+        if job is None:
+            continue
+        worker_pid = get_worker_pid(job_dir, job)
+        if job["status"] in ACTIVE_JOB_STATES and worker_pid and not pid_alive(worker_pid):
+            # the worker may have finished the job in the meantime
+            job = update_job(job_dir, only_if_active=True, status=JOB_FAILED, error="the worker process exited", finished=time.time())
+        jobs.append(job)
+    return jobs
+
+@contextmanager
+def scheduler_lock(workspaces_dir: Path):
+    """
+    Lock the scheduling of the jobs of all workspaces, only one worker at a time decides to start its job.
+
+    Args:
+        workspaces_dir (Path): directory with the workspaces.
+
+    Returns:
+        None
+    """
+    with directory_lock(Path(workspaces_dir, ".jobs.lock")):
+        yield
+
+def can_start_job(job_dir: Path, job: dict, workspaces_dir: Path) -> bool:
+    """
+    Check if a queued job can start now.
+
+    The jobs of all workspaces share the cores and memory of the machine. Queued jobs start in
+    submission order, a job starts when it is the oldest queued job and its threads and memory fit
+    next to the running jobs (a job always starts when nothing else runs).
+
+    Args:
+        job_dir (Path): job directory.
+        job (dict): the job state.
+        workspaces_dir (Path): directory with the workspaces.
+
+    Returns:
+        bool: True if the job can start
+    """
+    running, queued = [], []
+    for other_dir in workspaces_dir.glob("*/jobs/*"):
+        other = read_job(other_dir)
+        # jobs whose worker is gone never finish, cancelled jobs free their cores at once
+        if other is None or cancel_requested(other_dir) or not pid_alive(get_worker_pid(other_dir, other)):
+            continue
+        if other["status"] == JOB_RUNNING:
+            running.append(other)
+        elif other["status"] == JOB_QUEUED:
+            queued.append((other["created"], other_dir.resolve()))
+
+    if not queued or min(queued)[1] != Path(job_dir).resolve():
+        return False
+    if not running:
+        return True
+
+    threads = sum(other.get("threads") or 1 for other in running) + (job.get("threads") or 1)
+    memory_mb = sum(other.get("memory_mb") or 0 for other in running) + (job.get("memory_mb") or 0)
+    return threads <= job["max_cores"] and (not job["memory_budget_mb"] or memory_mb <= job["memory_budget_mb"])
+
+def wait_for_resources(job_dir: Path) -> bool:
+    """
+    Wait until a queued job can start, then mark it running. Called in the worker process.
+
+    Args:
+        job_dir (Path): job directory.
+
+    Returns:
+        bool: True if the job was started, False if it was cancelled while waiting
+    """
+    workspaces_dir = Path(read_job(job_dir)["workspace"]).resolve().parent
+    while not cancel_requested(job_dir):
+        with scheduler_lock(workspaces_dir):
+            job = read_job(job_dir)
+            if can_start_job(job_dir, job, workspaces_dir):
+                update_job(job_dir, status=JOB_RUNNING, started=time.time())
+                return True
+        time.sleep(SCHEDULER_INTERVAL)
+    return False
+
+def cancel_requested(job_dir: Path) -> bool:
+    """
+    Check if a job was cancelled.
+
+    Args:
+        job_dir (Path): job directory.
+
+    Returns:
+        bool: True if the job was cancelled
+    """
+    return Path(job_dir, "cancel").exists()
+
+def get_job_out(job: dict) -> Path:
+    """
+    Get the -out file of a search, its outputs are named after it.
+
+    Args:
+        job (dict): the job state.
+
+    Returns:
+        Path: the -out file
+    """
+    return Path(job.get("out") or Path(job["workspace"], "result-files", f"{job['name']}.idXML"))
+
+def get_job_outputs(job: dict, since: float = None) -> list[Path]:
+    """
+    Get the output files of a search: the files next to its -out file named <prefix><suffix>,
+    where <prefix> is the name of the -out file without extension and <suffix> matches OUTPUT_SUFFIX.
+
+    Args:
+        job (dict): the job state.
+        since (float): only files written at or after this time. Defaults to None, all files.
+
+    Returns:
+        list[Path]: the output files
+    """
+    out = get_job_out(job)
+    prefix = out.stem
+    if not out.parent.is_dir():
+        return []
+    return [f for f in sorted(out.parent.iterdir())
+            if f.is_file() and f.name.startswith(prefix) and OUTPUT_SUFFIX.fullmatch(f.name[len(prefix):])
+            and (since is None or f.stat().st_mtime >= since)]
+
+def remove_partial_outputs(job: dict) -> None:
+    """
+    Remove the outputs a cancelled search wrote to the result directory, outputs of earlier
+    searches of the same file and of other searches are kept.
+
+    Args:
+        job (dict): the job state.
+
+    Returns:
+        None
+    """
+    for f in get_job_outputs(job, since=job["started"] or job["created"]):
+        f.unlink(missing_ok=True)
+    Path(job["workspace"], "mzML-files", f"{job['name']}.mzML.ambigious_masses.csv").unlink(missing_ok=True)
+
+def cancel_job(workspace: Path, job_id: str) -> None:
+    """
+    Cancel a job. A running search is asked to terminate (SIGTERM to its process group) at once, the
+    worker kills it after CANCEL_GRACE_PERIOD seconds and removes its partial outputs.
+
+    The cores and memory of the job are free for other jobs immediately.
+
+    Args:
+        workspace (Path): workspace directory.
+        job_id (str): job id.
+
+    Returns:
+        None
+    """
+    job_dir = get_job_dir(workspace, job_id)
+    job = read_job(job_dir)
+    if job is None or job["status"] not in ACTIVE_JOB_STATES:
+        return
+
+    # the worker and the scheduler see the cancelled job by this file
+    Path(job_dir, "cancel").touch()
+    if job["pid"]:
+        signal_process_group(job["pid"])
+
+    # nobody is left to finish the job
+    if not pid_alive(get_worker_pid(job_dir, job)):
+        if job["pid"]:
+            signal_process_group(job["pid"], kill=True)
+        remove_partial_outputs(job)
+        update_job(job_dir, only_if_active=True, status=JOB_CANCELLED, finished=time.time())
+
+def get_job_dir(workspace: Path, job_id: str) -> Path:
+    """
+    Get the directory of a job.
+
+    Args:
+        workspace (Path): workspace directory.
+        job_id (str): job id.
+
+    Returns:
+        Path: the job directory
+    """
+    return Path(get_jobs_dir(workspace), job_id)
+
+def read_job_log(workspace: Path, job_id: str, stream: str = "stdout", max_bytes: int = None) -> str:
+    """
+    Read the log of a job, which is written while the job runs.
+
+    Args:
+        workspace (Path): workspace directory.
+        job_id (str): job id.
+        stream (str): "stdout" or "stderr". Defaults to "stdout".
+        max_bytes (int): read only the end of the log, at most this many bytes. Defaults to None, the whole log.
+
+    Returns:
+        str: the log, empty if not written yet
+    """
+    log_path = Path(get_job_dir(workspace, job_id), f"{stream}.log")
+    if not log_path.exists():
+        return ""
+    with open(log_path, "rb") as f:
+        if max_bytes:
+            # the log of a long search can be large, only its end is read
+            f.seek(max(0, f.seek(0, os.SEEK_END) - max_bytes))
+        return f.read().decode(errors="replace")
+
+def collect_job_outputs(job: dict, log_path: Path) -> None:
+    """
+    Move the outputs of a successful search which are not written to the result directory there.
+
+    Args:
+        job (dict): the job state.
+        log_path (Path): log (standard output) of the search.
+
+    Returns:
+        None
+    """
+    mzML_dir = Path(job["workspace"], "mzML-files")
+    result_dir = Path(job["workspace"], "result-files")
+
+    # OpenNuXL writes the ambiguous masses next to the mzML file
+    ambiguous_masses = Path(mzML_dir, f"{job['name']}.mzML.ambigious_masses.csv")
+    if ambiguous_masses.exists():
+        os.replace(ambiguous_masses, Path(result_dir, ambiguous_masses.name))
+
+    # Save the log to a text file in the result_dir
+    shutil.copyfile(log_path, Path(result_dir, f"{job['name']}_log.txt"))
+
+    # rename the file .raw.mzML --> .mzML, only the one converted by this search,
+    # the files of other searches running at the same time may still be written or opened
+    converted = Path(mzML_dir, f"{job['name']}.raw.mzML")
+    if converted.exists():
+        os.replace(converted, Path(mzML_dir, f"{job['name']}.mzML"))
+
+def run_job(job_dir: Path) -> None:
+    """
+    Run a job, called in the worker process.
+
+    The standard output and error of the search are written to stdout.log and stderr.log in the job directory.
+
+    Args:
+        job_dir (Path): job directory.
+
+    Returns:
+        None
+    """
+    job_dir = Path(job_dir).resolve()
+    job = update_job(job_dir, worker_pid=os.getpid())
+    os.chdir(job["cwd"])
+
+    stdout_path = Path(job_dir, "stdout.log")
+    stderr_path = Path(job_dir, "stderr.log")
+    try:
+        # identical search done before, its results are copied instead of searching again
+        if job.get("cache_mb"):
+            try:
+                # content addressed, the input files are hashed
+                job = update_job(job_dir, cache_key=search_cache_key(job["args"]))
+                if restore_search_result(job["workspace"], job["cache_key"], get_job_out(job).stem) is not None:
+                    now = time.time()
+                    update_job(job_dir, status=JOB_DONE, returncode=0, cached=True, started=now, finished=now)
+                    return
+            except Exception as e:
+                # searched without the cache
+                with open(stderr_path, "a") as stderr:
+                    stderr.write(f"The search cache could not be used: {e}\n")
+
+        # wait for free cores and memory
+        if not wait_for_resources(job_dir):
+            update_job(job_dir, status=JOB_CANCELLED, finished=time.time())
+            return
+
+        # the output goes to files, so a full pipe can never stall the search
+        with open(stdout_path, "w") as stdout, open(stderr_path, "a") as stderr:
+            # own process group, cancelling also stops the processes started by the search
+            process = subprocess.Popen(job["args"], stdout=stdout, stderr=stderr, stdin=subprocess.DEVNULL, **new_process_group())
+            job = update_job(job_dir, pid=process.pid)
+
+            terminated = None
+            while True:
+                try:
+                    returncode = process.wait(timeout=0.5)
+                    break
+                except subprocess.TimeoutExpired:
+                    if not cancel_requested(job_dir):
+                        continue
+                    if terminated is None:
+                        terminated = time.time()
+                        signal_process_group(process.pid)
+                    elif time.time() - terminated > CANCEL_GRACE_PERIOD:
+                        signal_process_group(process.pid, kill=True)
+
+        if cancel_requested(job_dir):
+            # processes started by the search may outlive it
+            signal_process_group(process.pid, kill=True)
+            remove_partial_outputs(job)
+            update_job(job_dir, status=JOB_CANCELLED, returncode=returncode, finished=time.time())
+            return
+
+        if returncode != 0:
+            update_job(job_dir, status=JOB_FAILED, returncode=returncode, error=f"exit code {returncode}", finished=time.time())
+            return
+
+        collect_job_outputs(job, stdout_path)
+        if job.get("cache_key"):
+            try:
+                outputs = get_job_outputs(job, since=job["started"])
+                store_search_result(job["workspace"], job["cache_key"], get_job_out(job).stem, outputs, job["cache_mb"])
+            except Exception as e:
+                # the search succeeded, it is just not cached (e.g. the disk is full)
+                with open(stderr_path, "a") as stderr:
+                    stderr.write(f"The results could not be added to the search cache: {e}\n")
+        update_job(job_dir, status=JOB_DONE, returncode=returncode, finished=time.time())
+    except Exception as e:
+        # e.g. the executable is missing, the job must not stay running
+        update_job(job_dir, status=JOB_FAILED, error=str(e), finished=time.time())
+
+if __name__ == "__main__":
+    run_job(Path(sys.argv[1]))
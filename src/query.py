@@ -0,0 +1,155 @@
+import re
+import pandas as pd
+from pathlib import Path
+
+try:
+    import duckdb
+
+    DUCKDB_AVAILABLE = True
+except ImportError:
+    DUCKDB_AVAILABLE = False
+
+from src.result_cache import build_CSM_cache, open_CSM_cache, PEAK_COLUMNS
+from src.result_files import read_protein_table
+
+######################### SQL queries over all result files of a workspace #######
+
+# tables of the protein output sections: section name -> SQL table name
+PROTEIN_TABLES = {
+    "PRTs_list": "proteins",
+    "run_summary": "run_summary",
+    "PRTs_summary": "protein_summary",
+    "efficiency": "crosslink_efficiency",
+    "adduct_summary": "adduct_summary",
+}
+
+# protein output file of a CSM result file: {prefix}_proteins{FDR}_XLs.tsv belongs to {prefix}_{FDR}_XLs.idXML
+PROTEIN_FILE = re.compile(r"^(.*)_proteins(.*)_XLs\.tsv$")
+
+# example query: CSMs per adduct per protein across runs
+EXAMPLE_QUERY = """SELECT run, accessions, "NuXL:NA" AS adduct, count(*) AS CSMs
+FROM CSMs
+GROUP BY ALL
+ORDER BY CSMs DESC"""
+
+def quote_identifier(name: str) -> str:
+    """
+    Quote a table or column name for SQL.
+
+    Args:
+        name (str): the name.
+
+    Returns:
+        str: the quoted name
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+def connect(workspace: Path, memory_limit_mb: int = None) -> "duckdb.DuckDBPyConnection":
+    """
+    Open an in-memory DuckDB database with the result files of a workspace as tables.
+
+    The queries can only read the registered tables, they have no access to other files.
+
+    Tables:
+        CSMs: the CSMs of all _XLs.idXML files, scanned from the memory-mapped cached tables (no copies),
+              with a "run" column naming the idXML file.
+        proteins, run_summary, protein_summary, crosslink_efficiency, adduct_summary:
+              the sections of all _proteins*_XLs.tsv files, with a "run" column naming the idXML file
+              they belong to (to join them with the CSMs).
+
+    Args:
+        workspace (Path): workspace directory.
+        memory_limit_mb (int): memory limit of the queries, larger intermediate results are spilled
+                               to the cache-files directory. Defaults to None, the DuckDB default.
+
+    Returns:
+        duckdb.DuckDBPyConnection: the connection
+
+    Raises:
+        ImportError: if duckdb is not installed.
+    """
+    if not DUCKDB_AVAILABLE:
+        raise ImportError("SQL queries need the duckdb package (pip install duckdb)")
+
+    result_dir = Path(workspace, "result-files")
+    con = duckdb.connect()
+    con.execute(f"SET temp_directory = '{Path(workspace, 'cache-files', 'duckdb')}'")
+    if memory_limit_mb:
+        con.execute(f"SET memory_limit = '{int(memory_limit_mb)}MB'")
+
+    # CSMs: one view per cached table, the files may have different meta value columns
+    CSM_views = []
+    for i, f in enumerate(sorted(result_dir.glob("*_XLs.idXML"))):
+        cache_path = build_CSM_cache(f)
+        if cache_path is None:
+            continue
+        table = open_CSM_cache(cache_path)
+        table = table.select([c for c in table.column_names if c not in PEAK_COLUMNS])
+        con.register(f"_CSMs_{i}", table)
+        CSM_views.append(f"SELECT '{f.name.replace(chr(39), chr(39) * 2)}' AS run, * FROM _CSMs_{i}")
+    if CSM_views:
+        con.execute("CREATE VIEW CSMs AS " + " UNION ALL BY NAME ".join(CSM_views))
+
+    # protein sections, small tables, read with the cached section reader
+    sections = {}
+    for f in sorted(result_dir.glob("*_proteins*_XLs.tsv")):
+        match = PROTEIN_FILE.match(f.name)
+        run = f"{match.group(1)}_{match.group(2)}_XLs.idXML" if match else f.name
+        for name, df in read_protein_table(f).items():
+            if name in PROTEIN_TABLES and df is not None:
+                sections.setdefault(name, []).append(df.assign(run=run))
+    for name, dfs in sections.items():
+        con.register(PROTEIN_TABLES[name], pd.concat(dfs, ignore_index=True))
+
+    # the queries see the registered tables only: no reading or writing of other files (read_csv, COPY, ATTACH, ...),
+    # and they can not change the settings back
+    con.execute("SET enable_external_access = false")
+    con.execute("SET lock_configuration = true")
+
+    return con
+
+def run_query(workspace: Path, sql: str, max_rows: int = None, memory_limit_mb: int = None) -> pd.DataFrame:
+    """
+    Run a SQL query over the result files of a workspace, see connect for the tables.
+
+    Args:
+        workspace (Path): workspace directory.
+        sql (str): the query.
+        max_rows (int): maximum number of returned rows. Defaults to None, all rows.
+        memory_limit_mb (int): memory limit of the query. Defaults to None.
+
+    Returns:
+        pd.DataFrame: the result, None if the statement returns no rows
+
+    Raises:
+        ImportError: if duckdb is not installed.
+        duckdb.Error: if the query fails.
+    """
+    con = connect(workspace, memory_limit_mb)
+    try:
+        relation = con.sql(sql)
+        if relation is None:
+            return None
+        if max_rows is not None:
+            relation = relation.limit(max_rows)
+        return relation.df()
+    finally:
+        con.close()
+
+def list_tables(workspace: Path) -> dict:
+    """
+    Get the tables of the workspace database and their columns.
+
+    Args:
+        workspace (Path): workspace directory.
+
+    Returns:
+        dict: table name -> list of column names
+    """
+    con = connect(workspace)
+    try:
+        tables = [row[0] for row in con.execute("SELECT table_name FROM information_schema.tables").fetchall()]
+        return {t: [row[0] for row in con.execute(f"DESCRIBE {quote_identifier(t)}").fetchall()]
+                for t in tables if not t.startswith("_")}
+    finally:
+        con.close()
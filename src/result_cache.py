@@ -0,0 +1,563 @@
+import os
+import re
+import json
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import streamlit as st
+from pathlib import Path
+from src.common import file_hash
+from src.result_files import readAndProcessIdXML, iter_idXML_batches, concat_CSM_dataframes, PeakAnnotations, IDXML_PARSER_VERSION, HEAVY_CSM_COLUMNS
+
+###################################### columnar cache of parsed .idXML files ##################################
+
+# idXML files larger than this (bytes) are parsed incrementally instead of loading them with pyOpenMS
+STREAMING_PARSER_THRESHOLD = 256 * 1024 * 1024
+
+# list columns holding the peak annotations (ragged arrays) in the cached table
+PEAK_COLUMNS = ["peak_mz", "peak_intensity", "peak_ion"]
+
+# filter expressions of numeric columns, e.g. "<0.01", ">= 3" or "2"
+NUMERIC_FILTER = re.compile(r"^\s*(<=|>=|!=|==|<|>|=)?\s*([-+0-9.eE]+)\s*$")
+NUMERIC_FILTER_OPERATORS = {"<": pc.less, "<=": pc.less_equal, ">": pc.greater, ">=": pc.greater_equal,
+                            "=": pc.equal, "==": pc.equal, "!=": pc.not_equal, None: pc.equal}
+
+def get_cache_dir(input_file: Path) -> Path:
+    """
+    Get the cache directory which belongs to a result file.
+
+    The cache directory "cache-files" lives next to the "result-files" directory of the workspace.
+
+    Args:
+        input_file (Path): Path to a file in the result-files directory.
+
+    Returns:
+        Path: The cache directory (created if not existing).
+    """
+    cache_dir = Path(input_file).parent.with_name("cache-files")
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+def get_CSM_cache_path(input_file: Path) -> Path:
+    """
+    Get the path of the cached CSM table of an idXML file.
+
+    The name contains the content hash of the idXML file and the parser version,
+    so a changed file or an updated parser never reads an outdated table.
+
+    Args:
+        input_file (Path): idXML file path.
+
+    Returns:
+        Path: Path of the Arrow IPC file with the CSM table.
+    """
+    input_file = Path(input_file)
+    return Path(get_cache_dir(input_file), f"{input_file.name}.{file_hash(input_file)[:16]}.v{IDXML_PARSER_VERSION}.arrow")
+
+def CSM_arrow_table(df: pd.DataFrame, peaks: PeakAnnotations) -> pa.Table:
+    """
+    Convert a CSM table and its peak annotations to an Arrow table.
+
+    The peak annotations are stored as list columns, i.e. one flat values buffer plus offsets.
+
+    Args:
+        df (pd.DataFrame): CSM table.
+        peaks (PeakAnnotations): Peak annotations of the CSMs.
+
+    Returns:
+        pa.Table: the table (without the ion labels, see write_CSM_cache)
+    """
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # meta values with mixed value types can not be stored as one typed column, store them as strings
+        mixed = df.select_dtypes(include="object").columns
+        table = pa.Table.from_pandas(df.astype({c: str for c in mixed}), preserve_index=False)
+
+    # add the ragged peak arrays, they share the offsets
+    offsets = pa.array(peaks.offsets, type=pa.int64())
+    for name, values in zip(PEAK_COLUMNS, [peaks.mz, peaks.intensity, peaks.ion_codes]):
+        table = table.append_column(name, pa.LargeListArray.from_arrays(offsets, pa.array(values)))
+    return table
+
+def write_arrow_file(schema: pa.Schema, tables, path: Path) -> None:
+    """
+    Write tables one after another as (uncompressed) Arrow IPC file, which can be memory-mapped later.
+
+    The file is written to a temporary file first, so other sessions never read a half written file.
+    Its name is unique, sessions are threads of one process and may convert the same file at once.
+
+    Args:
+        schema (pa.Schema): schema of the file, all tables have this schema.
+        tables: iterable of pa.Table, only one of them is needed at a time.
+        path (Path): Path of the Arrow IPC file.
+
+    Returns:
+        None
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, schema) as writer:
+                for table in tables:
+                    writer.write_table(table)
+        os.replace(tmp_path, path)
+    finally:
+        Path(tmp_path).unlink(missing_ok=True)
+
+def write_CSM_cache(df: pd.DataFrame, peaks: PeakAnnotations, cache_path: Path) -> bool:
+    """
+    Write a CSM table as (uncompressed) Arrow IPC file, which can be memory-mapped later.
+
+    The peak annotations are stored as list columns, see CSM_arrow_table.
+
+    Args:
+        df (pd.DataFrame): CSM table.
+        peaks (PeakAnnotations): Peak annotations of the CSMs.
+        cache_path (Path): Path of the Arrow IPC file.
+
+    Returns:
+        bool: True if the table was written.
+    """
+    table = CSM_arrow_table(df, peaks)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"ion_labels"] = json.dumps(list(peaks.ion_labels)).encode()
+    table = table.replace_schema_metadata(metadata)
+    write_arrow_file(table.schema, [table], cache_path)
+    return True
+
+def unify_CSM_column_type(types: list[pa.DataType]) -> pa.DataType:
+    """
+    Get the type of a CSM column which holds the values of the column in all batches,
+    like concat_CSM_dataframes: categorical in any batch stays categorical, int and float become float,
+    other mixed types become strings.
+
+    Args:
+        types (list[pa.DataType]): types of the column in the batches.
+
+    Returns:
+        pa.DataType: the column type
+    """
+    types = [t for t in types if not pa.types.is_null(t)]
+    if not types:
+        return pa.null()
+    if any(pa.types.is_dictionary(t) for t in types):
+        return pa.dictionary(pa.int32(), pa.string())
+    if all(t == types[0] for t in types):
+        return types[0]
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+        return pa.float64()
+    return pa.string()
+
+def conform_CSM_table(table: pa.Table, schema: pa.Schema, dictionaries: dict) -> pa.Table:
+    """
+    Cast a batch of the CSM table to the schema of the whole table, missing columns are null.
+
+    Args:
+        table (pa.Table): the batch.
+        schema (pa.Schema): schema of the whole table, see unify_CSM_column_type.
+        dictionaries (dict): column name -> values of the categorical columns, shared by all batches.
+
+    Returns:
+        pa.Table: the batch with the schema
+    """
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            column = table[field.name].combine_chunks()
+        else:
+            column = pa.nulls(table.num_rows)
+        if pa.types.is_dictionary(field.type):
+            # one dictionary for all batches, the IPC file format can not replace it between batches
+            dictionary = dictionaries[field.name]
+            indices = pc.index_in(column.cast(pa.string()), value_set=dictionary)
+            column = pa.DictionaryArray.from_arrays(indices, dictionary)
+        else:
+            column = column.cast(field.type)
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=schema)
+
+def write_CSM_cache_batches(batches, cache_path: Path) -> bool:
+    """
+    Write the CSM table of an idXML file batch by batch as Arrow IPC file, only one batch is in memory at a time.
+
+    The batches may have different columns and column types (meta values are added as they are found),
+    so every batch is spilled to its own file first. Then the batches are cast one by one
+    to the schema of the whole table and written to the cache file.
+
+    Args:
+        batches: iterable of (dataframe, PeakAnnotations) tuples, see iter_idXML_batches.
+        cache_path (Path): Path of the Arrow IPC file.
+
+    Returns:
+        bool: True if the table was written, False if there are no CSMs.
+    """
+    spill_dir = Path(tempfile.mkdtemp(dir=cache_path.parent, prefix=cache_path.name + ".", suffix=".tmp"))
+    try:
+        spill_files = []
+        ion_labels = []
+        for df, peaks in batches:
+            table = CSM_arrow_table(df, peaks)
+            spill_path = Path(spill_dir, f"{len(spill_files)}.arrow")
+            write_arrow_file(table.schema, [table], spill_path)
+            spill_files.append(spill_path)
+            # the batches share the ion codes, the last batch knows all of them
+            ion_labels = list(peaks.ion_labels)
+            del df, peaks, table
+        if not spill_files:
+            return False
+
+        # the columns in order of appearance, the peak columns last
+        types = {}
+        nullable = set() # int columns which are missing or incomplete in some batch
+        for spill_path in spill_files:
+            table = open_CSM_cache(spill_path)
+            for name in table.column_names:
+                types.setdefault(name, []).append(table.schema.field(name).type)
+                if table[name].null_count:
+                    nullable.add(name)
+            nullable.update(name for name in types if name not in table.column_names)
+        names = [n for n in types if n not in PEAK_COLUMNS] + PEAK_COLUMNS
+        schema = pa.schema([pa.field(n, unify_CSM_column_type(types[n])) for n in names])
+
+        # values of the categorical columns in all batches
+        dictionaries = {}
+        for field in schema:
+            if pa.types.is_dictionary(field.type):
+                values = set()
+                for spill_path in spill_files:
+                    table = open_CSM_cache(spill_path)
+                    if field.name in table.column_names:
+                        values.update(pc.unique(table[field.name].cast(pa.string())).to_pylist())
+                values.discard(None)
+                dictionaries[field.name] = pa.array(sorted(values), pa.string())
+
+        # pandas dtypes of the whole table (nullable ints, categoricals), as if the batches were concatenated
+        dtypes = {}
+        for field in schema:
+            if field.name in PEAK_COLUMNS:
+                continue
+            if pa.types.is_dictionary(field.type):
+                dtypes[field.name] = "category"
+            elif pa.types.is_integer(field.type):
+                dtypes[field.name] = "Int64" if field.name in nullable else "int64"
+            elif pa.types.is_floating(field.type):
+                dtypes[field.name] = "float64"
+            else:
+                dtypes[field.name] = "object"
+        metadata = dict(pa.Schema.from_pandas(pd.DataFrame({n: pd.Series(dtype=t) for n, t in dtypes.items()}), preserve_index=False).metadata)
+        metadata[b"ion_labels"] = json.dumps(ion_labels).encode()
+        schema = schema.with_metadata(metadata)
+
+        write_arrow_file(schema, (conform_CSM_table(open_CSM_cache(f), schema, dictionaries) for f in spill_files), cache_path)
+        return True
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+def open_CSM_cache(cache_path: Path) -> pa.Table:
+    """
+    Open a cached CSM table by memory-mapping the Arrow IPC file.
+
+    Nothing is read until columns of the table are accessed.
+
+    Args:
+        cache_path (Path): Path of the Arrow IPC file.
+
+    Returns:
+        pa.Table: the memory-mapped table
+    """
+    with pa.memory_map(str(cache_path), "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+def remove_CSM_cache(file_name: str, cache_dir: Path, keep: Path = None) -> None:
+    """
+    Remove cached CSM tables of a result file.
+
+    Args:
+        file_name (str): Name of the idXML file.
+        cache_dir (Path): The cache directory.
+        keep (Path): Cache file which should not be removed. Defaults to None.
+
+    Returns:
+        None
+    """
+    for f in Path(cache_dir).glob(f"{file_name}.*.arrow"):
+        if f != keep:
+            f.unlink(missing_ok=True)
+
+def build_CSM_cache(input_file: Path) -> Path:
+    """
+    Get the cached CSM table of an idXML file, convert the idXML first if the table is not cached yet.
+
+    Args:
+        input_file (Path): idXML file path.
+
+    Returns:
+        Path: Path of the Arrow IPC file, None if the file has no CSMs
+    """
+    cache_path = get_CSM_cache_path(input_file)
+
+    # cache hit, skip the XML entirely
+    if cache_path.exists():
+        return cache_path
+
+    # the pyOpenMS object graph of large files needs several times the file size in memory
+    if Path(input_file).stat().st_size > STREAMING_PARSER_THRESHOLD:
+        # the batches are written as they are parsed, the memory does not grow with the file size
+        if not write_CSM_cache_batches(iter_idXML_batches(input_file), cache_path):
+            return None
+    else:
+        df, peaks = readAndProcessIdXML(input_file)
+        if df is None:
+            return None
+        write_CSM_cache(df, peaks, cache_path)
+
+    # tables of older versions of this file or of older parser versions are outdated now
+    remove_CSM_cache(Path(input_file).name, cache_path.parent, keep=cache_path)
+    return cache_path
+
+def load_CSM_table(input_file: Path, columns: list[str] = None) -> pd.DataFrame:
+    """
+    Get the CSM table of an idXML file from the cached table, only the requested columns are read.
+
+    Args:
+        input_file (Path): idXML file path.
+        columns (list[str]): Columns to load. Defaults to None, all columns except the heavy per-hit payloads
+                             (see load_CSM_details).
+
+    Returns:
+        df: dataframe (.idXML -> dataframe), None if the file has no CSMs
+    """
+    cache_path = build_CSM_cache(input_file)
+    if cache_path is None:
+        return None
+
+    table = open_CSM_cache(cache_path)
+    if columns is None:
+        columns = [c for c in table.column_names if c not in PEAK_COLUMNS + HEAVY_CSM_COLUMNS]
+    # columns which are not selected are never read from the memory-mapped file
+    return table.select([c for c in columns if c in table.column_names]).to_pandas()
+
+def load_CSM_tables(input_files: list[Path], columns: list[str] = None, max_workers: int = None) -> pd.DataFrame:
+    """
+    Get one CSM table of several idXML files (e.g. the fractions of a study), with a "run" column naming the file.
+
+    Files which are not cached yet are converted in parallel worker processes
+    (pyOpenMS holds the GIL, so threads would convert them one after another).
+    Files which can not be converted (e.g. malformed idXML) are skipped, a warning names them.
+
+    Args:
+        input_files (list[Path]): idXML file paths.
+        columns (list[str]): Columns to load, see load_CSM_table. Defaults to None.
+        max_workers (int): Maximum number of worker processes. Defaults to None, the number of CPUs.
+
+    Returns:
+        df: dataframe of the CSMs of all files, None if no file has CSMs
+    """
+    input_files = [Path(f) for f in input_files]
+    missing = [f for f in input_files if not get_CSM_cache_path(f).exists()]
+    failed = {} # file -> error
+
+    if len(missing) > 1:
+        max_workers = min(len(missing), max_workers or os.cpu_count() or 1)
+        # spawn fresh interpreters, forking the streamlit server process is not safe
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            # the workers write the cached tables, the tables are memory-mapped here afterwards
+            futures = {f: pool.submit(build_CSM_cache, f) for f in missing}
+            for f, future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    failed[f] = e
+
+    dfs = []
+    for f in input_files:
+        if f in failed:
+            continue
+        try:
+            df = load_CSM_table(f, columns)
+        except Exception as e:
+            failed[f] = e
+            continue
+        if df is None:
+            continue
+        df.insert(0, "run", f.name)
+        dfs.append(df)
+
+    if failed:
+        st.warning("Skipped result files which could not be read: " + ", ".join(f"{f.name} ({e})" for f, e in failed.items()))
+    if not dfs:
+        return None
+
+    df = concat_CSM_dataframes(dfs)
+    df["run"] = df["run"].astype("category")
+    return df
+
+def load_CSM_details(input_file: Path, spec_id: str) -> dict:
+    """
+    Get the heavy per-hit payloads of one CSM: the annotated peaks and the columns in HEAVY_CSM_COLUMNS.
+
+    Args:
+        input_file (Path): idXML file path.
+        spec_id (str): SpecId of the CSM.
+
+    Returns:
+        dict: "mzarray", "intarray" and "anotarray" of the annotated peaks (views into the memory-mapped file)
+              plus the heavy columns, None if the CSM is not found
+    """
+    cache_path = build_CSM_cache(input_file)
+    if cache_path is None:
+        return None
+
+    table = open_CSM_cache(cache_path)
+    row = pc.index(table["SpecId"], spec_id).as_py()
+    if row < 0:
+        return None
+
+    # flat values of the list columns at this row
+    mz, intensity, ion_codes = [table[name].slice(row, 1).combine_chunks().flatten().to_numpy(zero_copy_only=True) for name in PEAK_COLUMNS]
+    ion_labels = np.asarray(json.loads(table.schema.metadata[b"ion_labels"]), dtype=object)
+
+    details = {"mzarray": mz, "intarray": intensity, "anotarray": ion_labels[ion_codes]}
+    for c in HEAVY_CSM_COLUMNS:
+        if c in table.column_names:
+            details[c] = table[c][row].as_py()
+    return details
+
+def get_CSM_columns(input_file: Path) -> list[str]:
+    """
+    Get the names of the CSM table columns of an idXML file, without the heavy per-hit payloads.
+
+    Args:
+        input_file (Path): idXML file path.
+
+    Returns:
+        list[str]: column names, None if the file has no CSMs
+    """
+    cache_path = build_CSM_cache(input_file)
+    if cache_path is None:
+        return None
+    return [c for c in open_CSM_cache(cache_path).column_names if c not in PEAK_COLUMNS + HEAVY_CSM_COLUMNS]
+
+def plain_column(column: pa.ChunkedArray) -> pa.ChunkedArray:
+    """
+    Decode a dictionary encoded (categorical) column to its values, other columns are returned as they are.
+
+    Args:
+        column (pa.ChunkedArray): column of the cached table.
+
+    Returns:
+        pa.ChunkedArray: the column
+    """
+    if pa.types.is_dictionary(column.type):
+        return column.cast(column.type.value_type)
+    return column
+
+def CSM_filter_mask(column: pa.ChunkedArray, expression: str) -> pa.ChunkedArray:
+    """
+    Evaluate a filter expression on one column of the cached table.
+
+    Numeric columns take a comparison ("<0.01", ">= 3", "!=0") or a value, all other columns
+    keep the rows containing the expression (case insensitive). Missing values never match.
+
+    Args:
+        column (pa.ChunkedArray): column of the cached table.
+        expression (str): filter expression.
+
+    Returns:
+        pa.ChunkedArray: boolean mask of the matching rows
+
+    Raises:
+        ValueError: if the expression of a numeric column is not a comparison.
+    """
+    column = plain_column(column)
+    if pa.types.is_integer(column.type) or pa.types.is_floating(column.type):
+        match = NUMERIC_FILTER.match(expression)
+        if match is None:
+            raise ValueError(f"'{expression}' is not a comparison like '<0.01' or '>= 3'")
+        operator, value = match.groups()
+        mask = NUMERIC_FILTER_OPERATORS[operator](column, pa.scalar(float(value)))
+    else:
+        mask = pc.match_substring(column.cast(pa.string()), expression, ignore_case=True)
+    return pc.fill_null(mask, False)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _CSM_row_order(cache_path: str, filters: tuple, sort_by: str, ascending: bool) -> np.ndarray:
+    """
+    Rows of the cached table passing the filters, in sort order. Cached, paging through the rows
+    of the same query does not filter or sort again.
+
+    Args:
+        cache_path (str): Path of the Arrow IPC file (contains the content hash of the idXML file).
+        filters (tuple): (column, expression) pairs, see CSM_filter_mask.
+        sort_by (str): column to sort by, None keeps the order of the file.
+        ascending (bool): sort order.
+
+    Returns:
+        np.ndarray: row indices
+    """
+    table = open_CSM_cache(Path(cache_path))
+    rows = np.arange(table.num_rows)
+
+    # only the filtered and sorted columns are read from the memory-mapped file
+    if filters:
+        mask = np.ones(table.num_rows, dtype=bool)
+        for column, expression in filters:
+            mask &= CSM_filter_mask(table[column], expression).to_numpy(zero_copy_only=False)
+        rows = rows[mask]
+
+    if sort_by:
+        column = plain_column(table[sort_by]).take(pa.array(rows))
+        order = pc.sort_indices(column, sort_keys=[("", "ascending" if ascending else "descending")], null_placement="at_end")
+        rows = rows[order.to_numpy()]
+    return rows
+
+def query_CSM_table(input_file: Path, page: int = 0, page_size: int = 10, sort_by: str = None, ascending: bool = True,
+                    filters: dict = None, columns: list[str] = None) -> tuple[pd.DataFrame, int]:
+    """
+    Get one page of the filtered and sorted CSM table of an idXML file.
+
+    Filtering, sorting and paging run on the memory-mapped cached table, only the rows of the page
+    are converted to a dataframe. The cost of a page does not depend on the number of CSMs.
+
+    Args:
+        input_file (Path): idXML file path.
+        page (int): page number, starting at 0. Defaults to 0.
+        page_size (int): rows per page. Defaults to 10.
+        sort_by (str): column to sort by. Defaults to None, the order of the file.
+        ascending (bool): sort order. Defaults to True.
+        filters (dict): column -> filter expression, see CSM_filter_mask. Defaults to None.
+        columns (list[str]): Columns of the page, see load_CSM_table. Defaults to None.
+
+    Returns:
+        tuple[pd.DataFrame, int]: the rows of the page and the number of rows passing the filters,
+                                  (None, 0) if the file has no CSMs
+
+    Raises:
+        ValueError: if a filter expression is invalid.
+    """
+    cache_path = build_CSM_cache(input_file)
+    if cache_path is None:
+        return None, 0
+
+    table = open_CSM_cache(cache_path)
+    if columns is None:
+        columns = [c for c in table.column_names if c not in PEAK_COLUMNS + HEAVY_CSM_COLUMNS]
+    columns = [c for c in columns if c in table.column_names]
+
+    filters = tuple((c, e) for c, e in (filters or {}).items() if e and c in table.column_names)
+    sort_by = sort_by if sort_by in table.column_names else None
+
+    start = page * page_size
+    if not filters and not sort_by:
+        # pages of the unsorted table are plain slices
+        return table.select(columns).slice(start, page_size).to_pandas(), table.num_rows
+
+    rows = _CSM_row_order(str(cache_path), filters, sort_by, ascending)
+    return table.select(columns).take(pa.array(rows[start:start + page_size])).to_pandas(), len(rows)
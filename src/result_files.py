@@ -1,14 +1,16 @@
 import io
 import os
+import mmap
 import shutil
 import base64
+import numpy as np
 import pandas as pd
 import streamlit as st
-from io import StringIO
 from pathlib import Path
 from zipfile import ZipFile
+from xml.etree.ElementTree import iterparse
 from pyopenms import IdXMLFile
-from src.common import reset_directory
+from src.common import reset_directory, file_hash
 
 def add_to_result(filename: str):
     """
@@ -57,11 +59,15 @@ def remove_selected_result_files(to_remove: list[str]) -> None:
     """
 
     result_dir: Path = Path(st.session_state.workspace, "result-files")
+    cache_dir: Path = Path(st.session_state.workspace, "cache-files")
 
     # remove all given selected files from result workspace directory
     for f in to_remove:
         # deleted files
         Path(result_dir, f).unlink() 
+        # deleted cached tables of the file
+        for cached in cache_dir.glob(f"{f}.*"):
+            cached.unlink()
         #st.session_state["selected-result-files"].remove(f)
     st.success("Selected result files removed!")
 
@@ -78,6 +84,11 @@ def remove_all_result_files() -> None:
 
     result_dir: Path = Path(st.session_state.workspace, "result-files")
 
+    # remove the cached tables of all result files, the cache directory also holds the spectrum
+    # indices and stores of the mzML files, which are kept
+    for f in result_dir.iterdir():
+        for cached in Path(st.session_state.workspace, "cache-files").glob(f"{f.name}.*"):
+            cached.unlink()
     # reset (delete and re-create) result directory in workspace
     reset_directory(result_dir)
     # reset selected result list
@@ -264,6 +275,91 @@ def download_selected_result_files(to_download: list[str], link_name: str) -> No
 
 ###################################### deal with .idXML file ##################################
 
+# version of the idXML -> dataframe conversion, increase if the output of readAndProcessIdXML changes (invalidates cached tables)
+IDXML_PARSER_VERSION = 4
+
+# per-hit payloads which are only needed for a selected CSM, not for the CSM table
+# (fragment_annotation are the peak annotations, see PeakAnnotations)
+HEAVY_CSM_COLUMNS = ["fragment_annotation", "NuXL:localization_scores"]
+
+class PeakAnnotations:
+    """
+    Peak annotations of all CSMs of an idXML file, stored as flat typed arrays (ragged array).
+
+    The annotated peaks of CSM i are mz[offsets[i]:offsets[i + 1]] (same for intensity and ion_codes),
+    ion_codes index into ion_labels.
+
+    Args:
+        mz (np.ndarray): m/z of all annotated peaks (float64).
+        intensity (np.ndarray): intensity of all annotated peaks (float32).
+        ion_codes (np.ndarray): code of the ion annotation of all annotated peaks (int32).
+        ion_labels (list[str]): ion annotation of every code.
+        offsets (np.ndarray): start of the peaks of every CSM, plus the total number of peaks (int64).
+    """
+
+    def __init__(self, mz, intensity, ion_codes, ion_labels, offsets):
+        self.mz = mz
+        self.intensity = intensity
+        self.ion_codes = ion_codes
+        self.ion_labels = np.asarray(ion_labels, dtype=object)
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def row(self, i):
+        """
+        get the annotated peaks of one CSM, m/z and intensities are views into the flat arrays (no copy)
+
+        Args:
+            i: row index of the CSM
+
+        Returns:
+            tuple: m/z values, intensities and ion annotations of the peaks
+        """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.mz[start:end], self.intensity[start:end], self.ion_labels[self.ion_codes[start:end]]
+
+    @classmethod
+    def from_lists(cls, mz, intensity, ion_codes, ion_labels, counts):
+        """
+        create the flat arrays from the peak values collected while parsing
+
+        Args:
+            mz: list of m/z values of all peaks
+            intensity: list of intensities of all peaks
+            ion_codes: list of ion codes of all peaks
+            ion_labels: ion annotation of every code
+            counts: number of peaks of every CSM
+
+        Returns:
+            PeakAnnotations
+        """
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(np.array(mz, dtype=np.float64), np.array(intensity, dtype=np.float32),
+                   np.array(ion_codes, dtype=np.int32), list(ion_labels), offsets)
+
+    @classmethod
+    def concat(cls, annotations):
+        """
+        concatenate peak annotations of consecutive batches of iter_idXML_batches (the batches share the ion codes)
+
+        Args:
+            annotations: list of PeakAnnotations
+
+        Returns:
+            PeakAnnotations
+        """
+        offsets = [np.zeros(1, dtype=np.int64)]
+        for a in annotations:
+            offsets.append(a.offsets[1:] + offsets[-1][-1])
+        return cls(np.concatenate([a.mz for a in annotations]),
+                   np.concatenate([a.intensity for a in annotations]),
+                   np.concatenate([a.ion_codes for a in annotations]),
+                   list(annotations[-1].ion_labels),
+                   np.concatenate(offsets))
+
 def strToFloat(df):
     """
     convert every string col into an int or float if possible of given dataframe 
@@ -274,179 +370,513 @@ def strToFloat(df):
     Returns:
         df: dataframe modified accordingly
     """
-    for col in df:
-        try:
-            #convert string col to float
-            df[col] = [float(i) for i in df[col]]
-        except ValueError:
+    for col in df.select_dtypes(include="object"):
+        #convert string col to float, if all values are numbers
+        values = pd.to_numeric(df[col], errors="coerce")
+        if not values.isna().any():
+            df[col] = values.astype(float)
+    return df
+
+# numpy dtypes of the static columns of the CSM table
+STATIC_CSM_COLUMNS = {'SpecId': object, 'PSMId': np.int64, 'Label': np.int64, 'Score': np.float64, 'ScanNr': np.int64,
+                      'Peptide': object, 'peplen': np.int64, 'ExpMass': np.float64,
+                      'charge2': np.int64, 'charge3': np.int64, 'charge4': np.int64, 'charge5': np.int64, 'accessions': object}
+
+# numpy dtypes of the meta value columns by python type of their values (None: strings or mixed types)
+META_VALUE_DTYPES = {int: np.int64, float: np.float64, None: object}
+
+# conversion of idXML UserParam values according to their type attribute
+USERPARAM_TYPES = {"int": int, "float": float}
+
+# string columns which are always stored as categoricals, other string columns only if at most half of their values are unique
+CATEGORICAL_CSM_COLUMNS = ["NuXL:NA", "NuXL:NT", "target_decoy", "accessions"]
+
+def meta_value_type(value):
+    """
+    get the column type of a meta value 
+
+    Args:
+        value: meta value
+
+    Returns:
+        int, float or None (string or other values)
+    """
+    return type(value) if type(value) in (int, float) else None
+
+def add_CSM_column(arrays, masks, name, dtype, n):
+    """
+    add an empty column array to the CSM table
+
+    Args:
+        arrays: dict of column name -> array
+        masks: dict of meta value column name -> bool array, True where a value was set
+        name: column name
+        dtype: numpy dtype of the column
+        n: number of rows
+
+    Returns:
+        None
+    """
+    if dtype == np.float64:
+        arrays[name] = np.full(n, np.nan)
+    elif dtype == object:
+        arrays[name] = np.empty(n, dtype=object)
+    else:
+        arrays[name] = np.zeros(n, dtype=dtype)
+    # the static columns are set for every CSM
+    if name not in STATIC_CSM_COLUMNS:
+        masks[name] = np.zeros(n, dtype=bool)
+
+def allocate_CSM_columns(types, n):
+    """
+    preallocate the column arrays of the CSM table
+
+    Args:
+        types: dict of meta value name -> column type, see meta_value_type
+        n: number of rows
+
+    Returns:
+        arrays: dict of column name -> array (float: NaN, string: None)
+        masks: dict of meta value column name -> bool array, True where a value was set
+    """
+    arrays = {}; masks = {}
+    for name, dtype in STATIC_CSM_COLUMNS.items():
+        add_CSM_column(arrays, masks, name, dtype, n)
+    for name, t in types.items():
+        add_CSM_column(arrays, masks, name, META_VALUE_DTYPES[t], n)
+    return arrays, masks
+
+def promote_CSM_column(arrays, masks, types, name, value):
+    """
+    widen the type of a meta value column so it can hold the value,
+    int columns become float for float values, everything else becomes strings (object)
+
+    Args:
+        arrays: dict of column name -> array
+        masks: dict of meta value column name -> bool array, True where a value was set
+        types: dict of meta value name -> column type, updated accordingly
+        name: column name
+        value: meta value which does not match the column type
+
+    Returns:
+        None
+    """
+    values = arrays[name]
+    if values.dtype.kind == "f" and type(value) == int:
+        return # ints fit into float columns
+    if values.dtype.kind == "i" and type(value) == float:
+        values = values.astype(np.float64)
+        values[~masks[name]] = np.nan
+        types[name] = float
+    else:
+        values = values.astype(object)
+        values[~masks[name]] = None
+        types[name] = None
+    arrays[name] = values
+
+def CSM_dataframe(arrays, masks, n, columns=None):
+    """
+    create the CSM dataframe from the column arrays, 
+    int columns with missing values become nullable and low-cardinality strings categoricals
+
+    Args:
+        arrays: dict of column name -> array, see allocate_CSM_columns
+        masks: dict of meta value column name -> bool array, True where a value was set
+        n: number of filled rows
+        columns: columns to keep (default None: all columns)
+
+    Returns:
+        df: dataframe of the CSMs
+    """
+    data = {}
+    for name, values in arrays.items():
+        if columns is not None and name not in columns:
             continue
+        values = values[:n]
+        if values.dtype.kind == "i" and name in masks and not masks[name][:n].all():
+            values = pd.arrays.IntegerArray(values, ~masks[name][:n])
+        elif values.dtype == object and (name in CATEGORICAL_CSM_COLUMNS or len(pd.unique(values)) <= n / 2):
+            values = pd.Categorical(values)
+        data[name] = values
+    return pd.DataFrame(data)
+
+def concat_CSM_dataframes(dfs):
+    """
+    concatenate CSM dataframes, keeping the column types of the single dataframes 
+
+    Args:
+        dfs: list of CSM dataframes, columns may differ
+
+    Returns:
+        df: dataframe of all CSMs
+    """
+    df = pd.concat(dfs, ignore_index=True)
+    for name in df.columns:
+        dtypes = [d[name].dtype for d in dfs if name in d]
+        # concatenated categoricals with different categories become strings again
+        if any(isinstance(t, pd.CategoricalDtype) for t in dtypes):
+            df[name] = df[name].astype("category")
+        # int columns which are missing in some batches become float
+        elif df[name].dtype.kind == "f" and all(t.kind in "iu" for t in dtypes):
+            df[name] = df[name].astype("Int64")
     return df
 
-def readAndProcessIdXML(input_file, top=1):
+def concat_CSM_batches(batches):
+    """
+    concatenate the (dataframe, PeakAnnotations) batches of iter_idXML_batches 
+
+    Args:
+        batches: list of (dataframe, PeakAnnotations) tuples
+
+    Returns:
+        df: dataframe of all CSMs
+        peaks: PeakAnnotations of all CSMs, None if not converted
+    """
+    df = concat_CSM_dataframes([b[0] for b in batches])
+    peaks = PeakAnnotations.concat([b[1] for b in batches]) if batches[0][1] is not None else None
+    return df, peaks
+
+def readAndProcessIdXML(input_file, top=1, columns=None):
     """
     convert the (.idXML) format identification file to dataframe
 
     Args:
         input_file: idXML file path 
         top: top hits (dafault 1)
+        columns: columns to convert (default None: all columns), 
+                 peak annotations are only converted if "fragment_annotation" is one of them
 
     Returns:
         df: dataframe (.idXML -> dataframe)
+        peaks: PeakAnnotations of the CSMs (same order as the dataframe rows), None if not converted
     """
     prot_ids = []; pep_ids = []
     IdXMLFile().load(str(input_file), prot_ids, pep_ids)
-    meta_value_keys = []
-    rows = []
-    #st.write("len of pep_ids:", len(pep_ids))
-    if len(pep_ids)>0:
-        for peptide_id in pep_ids:
-            spectrum_id = peptide_id.getMetaValue("spectrum_reference")
-            scan_nr = spectrum_id[spectrum_id.rfind('=') + 1 : ]
-
-            hits = peptide_id.getHits()
-
-            psm_index = 1
-            for h in hits:
-                if psm_index > top:
-                    break
-                charge = h.getCharge()
-                score = h.getScore()
-                z2 = 0; z3 = 0; z4 = 0; z5 = 0
-
-                if charge == 2:
-                    z2 = 1
-                if charge == 3:
-                    z3 = 1
-                if charge == 4:
-                    z4 = 1
-                if charge == 5:
-                    z5 = 1
-                if "target" in h.getMetaValue("target_decoy"):
-                    label = 1
-                else:
-                    label = 0
-                sequence = h.getSequence().toString()
-                if len(meta_value_keys) == 0: # fill meta value keys on first run
-                    h.getKeys(meta_value_keys)
-                    meta_value_keys = [x.decode() for x in meta_value_keys]
-                    all_columns = ['SpecId','PSMId','Label','Score','ScanNr','Peptide','peplen','ExpMass','charge2','charge3','charge4','charge5','accessions', 'intensities', 'mz_values','ions'] + meta_value_keys
-                    #print(all_columns)
-                # static part
-                accessions = ';'.join([s.decode() for s in h.extractProteinAccessionsSet()])
+    with_peaks = columns is None or "fragment_annotation" in columns
+    # peak annotations of all CSMs as flat lists
+    peak_mz = []; peak_intensity = []; peak_ions = []; peak_counts = []
+    ion_codes = {} # ion annotation -> code
+
+    # first pass: the union of the meta value keys of all hits, typed by their first value
+    hits = [None] * len(pep_ids) # (peptide identification, first hit)
+    names = {} # meta value key -> column name
+    types = {} # column name -> column type
+    n = 0
+    for peptide_id in pep_ids:
+        peptide_hits = peptide_id.getHits()
+        if not peptide_hits or top < 1:
+            continue
+        h = peptide_hits[0] # parse only first hit
+        hits[n] = (peptide_id, h)
+        n += 1
+        keys = []
+        h.getKeys(keys)
+        for k in keys:
+            if k not in names:
+                names[k] = k.decode() if type(k) == bytes else k
+                if columns is None or names[k] in columns:
+                    s = h.getMetaValue(k)
+                    types[names[k]] = meta_value_type(s.decode() if type(s) == bytes else s)
+
+    if n == 0:
+        return None, None
+
+    # second pass: fill the preallocated columns
+    arrays, masks = allocate_CSM_columns(types, n)
+    for i, (peptide_id, h) in enumerate(hits[:n]):
+        spectrum_id = peptide_id.getMetaValue("spectrum_reference")
+        charge = h.getCharge()
+        sequence = h.getSequence().toString()
+
+        # static part
+        arrays['SpecId'][i] = spectrum_id
+        arrays['PSMId'][i] = 1
+        arrays['Label'][i] = 1 if "target" in h.getMetaValue("target_decoy") else 0
+        arrays['Score'][i] = h.getScore()
+        arrays['ScanNr'][i] = int(spectrum_id[spectrum_id.rfind('=') + 1 : ])
+        arrays['Peptide'][i] = sequence
+        arrays['peplen'][i] = len(sequence)
+        arrays['ExpMass'][i] = peptide_id.getMZ()
+        if 2 <= charge <= 5:
+            arrays[f'charge{charge}'][i] = 1
+        arrays['accessions'][i] = ';'.join([s.decode() for s in h.extractProteinAccessionsSet()])
+
+        #get peak annotations
+        if with_peaks:
+            peak_annotation = h.getPeakAnnotations()
+            for peak in peak_annotation:
+                peak_intensity.append(peak.intensity)
+                peak_mz.append(peak.mz)
+                peak_ions.append(ion_codes.setdefault(str(peak.annotation), len(ion_codes)))
+            peak_counts.append(len(peak_annotation))
+
+        # scores in meta values, only the keys of this hit
+        keys = []
+        h.getKeys(keys)
+        for k in keys:
+            name = names[k]
+            if name not in types: # not selected
+                continue
+            s = h.getMetaValue(k)
+            if type(s) == bytes:
+                s = s.decode()
+            if types[name] is not None and type(s) != types[name]:
+                promote_CSM_column(arrays, masks, types, name, s)
+            arrays[name][i] = s
+            masks[name][i] = True
+
+    peaks = PeakAnnotations.from_lists(peak_mz, peak_intensity, peak_ions, ion_codes, peak_counts) if with_peaks else None
+    return CSM_dataframe(arrays, masks, n, columns), peaks
+
+def iter_idXML_batches(input_file, batch_size=10000, top=1, columns=None):
+    """
+    convert the (.idXML) format identification file to dataframes of fixed size, 
+    the file is parsed incrementally without building the pyOpenMS objects of the whole file
+
+    Args:
+        input_file: idXML file path 
+        batch_size: number of CSMs per dataframe (default 10000)
+        top: top hits (dafault 1)
+        columns: columns to convert (default None: all columns), see readAndProcessIdXML
 
-                #get peak annotations
-                peak_annotation = h.getPeakAnnotations()
-                intensity_values_ = []  # To store peak.intensity values
-                mz_values_ = []  # To store peak.mz values
-                annotations_ = [] # To store ions annotations
+    Returns:
+        generator of (dataframe, PeakAnnotations) tuples like readAndProcessIdXML, 
+        meta values which first occur in a later batch are missing in the earlier batches (see concat_CSM_batches)
+    """
+    accession_of = {} # protein hit id -> accession
+    types = {} # column name -> column type, of all UserParams seen so far
+    skipped = set() # UserParams which are not selected
+    i = 0 # current row of the batch
+    run = None
+    # peak annotations of the current batch as flat lists, the ion codes are shared by all batches
+    peak_mz = []; peak_intensity = []; peak_ions = []; peak_counts = []
+    ion_codes = {} # ion annotation -> code
+    with_peaks = columns is None or "fragment_annotation" in columns
+
+    for event, elem in iterparse(str(input_file), events=("start", "end")):
+        # remember the parent of the peptide identifications, to drop them after parsing
+        if event == "start":
+            if elem.tag == "IdentificationRun":
+                run = elem
+            continue
+
+        if elem.tag == "ProteinHit":
+            accession_of[elem.get("id")] = elem.get("accession")
+            elem.clear()
 
-                for peak in peak_annotation:
-                    intensity_values_.append(str(peak.intensity))
-                    mz_values_.append(str(peak.mz))
-                    annotations_.append(str(peak.annotation))
+        elif elem.tag == "PeptideIdentification":
+            h = elem.find("PeptideHit") # parse only first hit
+            if h is not None and top >= 1:
+                if i == 0: # new batch
+                    arrays, masks = allocate_CSM_columns(types, batch_size)
 
-                # change list in to string with , seperate
-                intensities = ",".join(intensity_values_)
-                mz_values = ",".join(mz_values_)
-                ions = ",".join(annotations_)
+                spectrum_id = elem.get("spectrum_reference", "")
+                charge = int(h.get("charge", 0))
+                sequence = h.get("sequence")
+                label = 0
+                n_peaks = 0 # hits without fragment_annotation have no annotated peaks
 
-                row = [spectrum_id, psm_index, label, score, scan_nr, sequence, str(len(sequence)), peptide_id.getMZ(), z2, z3, z4, z5, accessions, intensities, mz_values, ions]
                 # scores in meta values
-                for k in meta_value_keys:
-                    s = h.getMetaValue(k)
-                    if type(s) == bytes:
-                        s = s.decode()
-                    row.append(s)
-                rows.append(row)
-                psm_index += 1
-                break; # parse only first hit
-    
-        df =pd.DataFrame(rows, columns=all_columns)
-        convert_dict = {'SpecId': str,
-                        'PSMId': int,
-                        'Label': int,
-                        'Score': float,
-                        'ScanNr': int,
-                        'peplen': int                
-                    }
-        
-        df = df.astype(convert_dict)
-        return df
-    
-    else: 
-        return None
+                for param in h.iterfind("UserParam"):
+                    name = param.get("name")
+                    if name == "fragment_annotation":
+                        # peak annotations are stored as: mz,intensity,charge,"annotation"|...
+                        if with_peaks:
+                            peaks = [peak.split(",", 3) for peak in param.get("value").split("|") if peak]
+                            for mz, intensity, _, annotation in peaks:
+                                peak_intensity.append(float(intensity))
+                                peak_mz.append(float(mz))
+                                peak_ions.append(ion_codes.setdefault(annotation.strip('"'), len(ion_codes)))
+                            n_peaks = len(peaks)
+                        continue
+                    if name == "target_decoy" and "target" in param.get("value"):
+                        label = 1
+                    if name not in arrays:
+                        if name in skipped:
+                            continue
+                        if columns is not None and name not in columns:
+                            skipped.add(name)
+                            continue
+                        # first occurrence of this UserParam, add the column
+                        types[name] = USERPARAM_TYPES.get(param.get("type"))
+                        add_CSM_column(arrays, masks, name, META_VALUE_DTYPES[types[name]], batch_size)
+                    s = USERPARAM_TYPES.get(param.get("type"), str)(param.get("value"))
+                    if types[name] is not None and type(s) != types[name]:
+                        promote_CSM_column(arrays, masks, types, name, s)
+                    arrays[name][i] = s
+                    masks[name][i] = True
+
+                # static part
+                arrays['SpecId'][i] = spectrum_id
+                arrays['PSMId'][i] = 1
+                arrays['Label'][i] = label
+                # pyOpenMS reads the hit score with single precision
+                arrays['Score'][i] = np.float32(h.get("score"))
+                arrays['ScanNr'][i] = int(spectrum_id[spectrum_id.rfind('=') + 1 : ])
+                arrays['Peptide'][i] = sequence
+                arrays['peplen'][i] = len(sequence)
+                arrays['ExpMass'][i] = float(elem.get("MZ"))
+                if 2 <= charge <= 5:
+                    arrays[f'charge{charge}'][i] = 1
+                arrays['accessions'][i] = ';'.join(sorted({accession_of[ref] for ref in h.get("protein_refs", "").split()}))
+                if with_peaks:
+                    # one entry per hit, the peak offsets of the following hits depend on it
+                    peak_counts.append(n_peaks)
+                i += 1
+
+            # free the parsed element
+            elem.clear()
+            if run is not None:
+                run.remove(elem)
+
+            if i == batch_size:
+                peaks = PeakAnnotations.from_lists(peak_mz, peak_intensity, peak_ions, ion_codes, peak_counts) if with_peaks else None
+                yield CSM_dataframe(arrays, masks, i, columns), peaks
+                i = 0
+                peak_mz = []; peak_intensity = []; peak_ions = []; peak_counts = []
+
+    if i > 0:
+        peaks = PeakAnnotations.from_lists(peak_mz, peak_intensity, peak_ions, ion_codes, peak_counts) if with_peaks else None
+        yield CSM_dataframe(arrays, masks, i, columns), peaks
   
+# fragment mass tolerance if the idXML has no search parameters
+DEFAULT_FRAGMENT_TOLERANCE = (20.0, "ppm")
+
+def read_fragment_tolerance(input_file):
+    """
+    read the fragment mass tolerance of the search from the (.idXML) search parameters,
+    parsing stops at the first peptide identification 
+
+    Args:
+        input_file: idXML file path 
+
+    Returns:
+        tuple: tolerance (float), unit ("ppm" or "Da")
+    """
+    for event, elem in iterparse(str(input_file), events=("start",)):
+        if elem.tag == "SearchParameters" and elem.get("peak_mass_tolerance"):
+            unit = "ppm" if elem.get("peak_mass_tolerance_ppm", "true") == "true" else "Da"
+            return float(elem.get("peak_mass_tolerance")), unit
+        if elem.tag == "PeptideIdentification":
+            break
+    return DEFAULT_FRAGMENT_TOLERANCE
+
 ######################### deal with (.tsv) file of proteins #######
 
+# sections of the protein table by the start of their title line (the protein list has no title):
+# section name, read_csv arguments
+PROTEIN_SECTIONS = {
+    "": ("PRTs_list", {}),
+    "Run summary": ("run_summary", {"header": None, "names": ["summary", "value"]}),
+    "Protein summary": ("PRTs_summary", {}),
+    # this section has no header line
+    "Crosslink efficiency": ("efficiency", {"header": None, "names": ["AA", "Crosslink efficiency"]}),
+    "Precursor adduct summary": ("adduct_summary", {}),
+}
+
+def protein_section_of(title):
+    """
+    get the name and read_csv arguments of a protein table section 
+
+    Args:
+        title: title line of the section
+
+    Returns:
+        tuple of section name, dict of read_csv arguments
+    """
+    for prefix, section in PROTEIN_SECTIONS.items():
+        if prefix and title.startswith(prefix):
+            return section
+    if not title:
+        return PROTEIN_SECTIONS[""]
+    # unknown section, named by its title
+    return title.rstrip(":"), {}
+
+@st.cache_data
+def _index_protein_table(input_file, content_hash):
+    """
+    find the byte ranges of the sections (separated by "=====" lines) of the protein table, 
+    cached by content hash of the file 
+
+    Args:
+        input_file: input file of protein output (.tsv) format
+        content_hash: content hash of the file (cache key)
+
+    Returns:
+        sections: dict of section name -> (title, start, end) byte offsets of the section content
+    """
+    sections = {}
+    with open(input_file, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return sections
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0 # start of the current section
+            title = ""
+            while True:
+                separator = mm.find(b"\n==", start)
+                end = len(mm) if separator < 0 else separator + 1
+                sections[protein_section_of(title)[0]] = (title, start, end)
+                if separator < 0:
+                    break
+                # the title is the line after the separator, the content starts below it
+                title_start = mm.find(b"\n", separator + 1) + 1
+                if title_start == 0:
+                    break
+                start = mm.find(b"\n", title_start) + 1 or len(mm)
+                title = mm[title_start:start].decode().strip()
+    return sections
+
+@st.cache_data
+def _read_protein_section(input_file, content_hash, name):
+    """
+    read one section of the protein table with a single read_csv over its bytes, 
+    cached by content hash of the file 
+
+    Args:
+        input_file: input file of protein output (.tsv) format
+        content_hash: content hash of the file (cache key)
+        name: section name, see PROTEIN_SECTIONS
+
+    Returns:
+        section_df: dataframe of the section, None if the file has no such section
+    """
+    sections = _index_protein_table(input_file, content_hash)
+    if name not in sections:
+        return None
+    title, start, end = sections[name]
+    read_args = protein_section_of(title)[1]
+
+    with open(input_file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        with memoryview(mm)[start:end] as content:
+            try:
+                return pd.read_csv(io.BytesIO(content), delimiter='\t', **read_args)
+            except pd.errors.EmptyDataError:
+                # Handle the EmptyDataError by creating an empty DataFrame with appropriate headers
+                return pd.DataFrame(columns=read_args.get("names", []))
+
+def read_protein_section(input_file, name):
+    """
+    convert one section of the (.tsv) protein output table to dataframe, 
+    only this section is parsed
+
+    Args:
+        input_file: input file of protein output (.tsv) format
+        name: section name: "PRTs_list", "run_summary", "PRTs_summary", "efficiency" or "adduct_summary"
+
+    Returns:
+        section_df: dataframe of the section, None if the file has no such section
+    """
+    return _read_protein_section(str(input_file), file_hash(Path(input_file)), name)
+
 def read_protein_table(input_file):
     """
-    convert the (.tsv) protein output table to dataframe
+    convert the (.tsv) protein output table to dataframes
 
     Args:
-        input_file: input file of protein output (.tsv) format1
+        input_file: input file of protein output (.tsv) format
 
     Returns:
-        section_dfs: list of dataframes contain 4 dataframe
-    """
-    section_dfs = []
-    current_section = []
-    skip_next_line = False
-    use_next_line_as_header = False
-
-    # Read the TSV file line by line
-    with open(input_file, 'r') as f:
-        for line in f:
-            line = line.strip()
-
-            # Check if the line is a section header
-            if line.startswith('==') and line.endswith('=='):
-                # Save the current section DataFrame to the list
-                if current_section:
-                    # If the section is 2, 3, or 5, use the next line as the header and remove the current header
-                    if use_next_line_as_header:
-                        try:
-                            section_df = pd.read_csv(StringIO('\n'.join(current_section[1:])), delimiter='\t', header=None)
-                            section_df.columns = current_section[0].split('\t')
-                        except pd.errors.EmptyDataError:
-                            # Handle the EmptyDataError by creating an empty DataFrame with appropriate headers
-                            section_df = pd.DataFrame(columns=current_section[0].split('\t'))
-                        section_dfs.append(section_df)
-                        use_next_line_as_header = False
-                    else:
-                        try:
-                            section_df = pd.read_csv(StringIO('\n'.join(current_section)), delimiter='\t')
-                        except pd.errors.EmptyDataError:
-                            # Handle the EmptyDataError by creating an empty DataFrame
-                            section_df = pd.DataFrame()
-                        section_dfs.append(section_df)
-
-                    current_section = []
-                    skip_next_line = True
-            else:
-                # Append the line to the current section content
-                if not skip_next_line:
-                    current_section.append(line)
-                skip_next_line = False
-
-                # Check if the next section should use the next line as the header
-                if line.startswith("Protein summary") or line.startswith("Crosslink efficiency") or line.startswith("Precursor adduct summary"):
-                    use_next_line_as_header = True
-
-                # Check if section 4, then update header
-                if line.startswith("Crosslink efficiency"):
-                    use_next_line_as_header = False
-                    header_line = next(f).strip()
-                    header = ["AA", "Crosslink efficiency"]
-                    current_section.append(header_line)
-                    current_section[0] = "\t".join(header)
-
-    # Append the last section to the list
-    if current_section:
-        try:
-            section_df = pd.read_csv(StringIO('\n'.join(current_section)), delimiter='\t')
-        except pd.errors.EmptyDataError:
-            # Handle the EmptyDataError by creating an empty DataFrame
-            section_df = pd.DataFrame()
-        section_dfs.append(section_df)
-
-    return section_dfs
\ No newline at end of file
+        section_dfs: dict of section name -> dataframe, see read_protein_section
+    """
+    sections = _index_protein_table(str(input_file), file_hash(Path(input_file)))
+    return {name: read_protein_section(input_file, name) for name in sections}
@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+from src.common import file_hash, REPOSITORY_NAME
+
+###################################### cache of search results ##################################
+
+# results of OpenNuXL searches, keyed by the content of the input files and the search settings:
+# submitting the same mzML and fasta file with the same settings again (in any workspace) copies the
+# earlier results into the result directory instead of searching again
+
+# version of the cached results, increase if the outputs of a search change (invalidates cached results);
+# version 1 results were hardlinks into the result directories, which later searches could overwrite
+SEARCH_CACHE_VERSION = 2
+
+# options whose values are input files, the key contains their content hash instead of the path
+INPUT_OPTIONS = ("-in", "-database")
+
+# options which do not change the results (paths of the outputs and of the executables, threads)
+IGNORED_OPTIONS = ("-out", "-threads", "-percolator_executable", "-ThermoRaw_executable")
+
+def get_search_cache_dir(workspace: Path) -> Path:
+    """
+    Get the directory of the search cache, it is shared by all workspaces.
+
+    It lives next to the workspaces directory, not in it: every directory in there is a workspace
+    (listed in the workspace switcher, removed by clean-up-workspaces.py when not modified for a while).
+
+    Args:
+        workspace (Path): workspace directory.
+
+    Returns:
+        Path: The search cache directory (created if not existing).
+    """
+    workspaces_dir = Path(workspace).resolve().parent
+    cache_dir = Path(workspaces_dir.parent, f"search-cache-{REPOSITORY_NAME}")
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+def search_cache_key(args: list[str]) -> str:
+    """
+    Get the cache key of a search: a hash of the content of its input files and its normalized arguments.
+
+    Args:
+        args (list[str]): The command and its arguments as a list of strings.
+
+    Returns:
+        str: the cache key
+    """
+    normalized = [f"v{SEARCH_CACHE_VERSION}"]
+    # the executable (first argument) is left out, its path differs between installations
+    i = 1
+    while i < len(args):
+        option = str(args[i])
+        if option in IGNORED_OPTIONS:
+            i += 2
+            continue
+        normalized.append(option)
+        if option in INPUT_OPTIONS and i + 1 < len(args):
+            normalized.append(file_hash(Path(args[i + 1])))
+            i += 2
+            continue
+        i += 1
+    return hashlib.sha256(json.dumps(normalized).encode()).hexdigest()
+
+def copy_file(source: Path, target: Path) -> None:
+    """
+    Copy a file into or out of the cache.
+
+    The files are copied, not hardlinked: the outputs in the result directory are written again by later
+    searches of the same file (in place, e.g. the log), which would change a linked cached result too.
+    The copy replaces the target at once, an existing target file is never written to.
+
+    Args:
+        source (Path): the existing file.
+        target (Path): the new file (replaced if existing).
+
+    Returns:
+        None
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=Path(target).parent, prefix=Path(target).name + ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        shutil.copy2(source, tmp_path)
+        os.replace(tmp_path, target)
+    finally:
+        Path(tmp_path).unlink(missing_ok=True)
+
+def store_search_result(workspace: Path, key: str, name: str, outputs: list[Path], max_mb: int) -> None:
+    """
+    Add the outputs of a successful search to the cache, then evict the least recently used results
+    above the size limit.
+
+    Args:
+        workspace (Path): workspace directory.
+        key (str): cache key of the search, see search_cache_key.
+        name (str): protocol name of the search (prefix of its output files).
+        outputs (list[Path]): the output files of the search, their names start with the protocol name.
+        max_mb (int): size limit of the cache (MB), 0 disables the cache.
+
+    Returns:
+        None
+    """
+    if not max_mb:
+        return
+    cache_dir = get_search_cache_dir(workspace)
+    entry = Path(cache_dir, key)
+    if entry.exists():
+        return
+
+    # write to a temporary directory first, other workers never see a half written result
+    tmp_entry = Path(tempfile.mkdtemp(dir=cache_dir, prefix=f"{key}.", suffix=".tmp"))
+    size = 0
+    for f in outputs:
+        # stored without the protocol name, the results are restored for any name
+        copy_file(f, Path(tmp_entry, Path(f).name[len(name):]))
+        size += Path(f).stat().st_size
+    with open(Path(tmp_entry, "meta.json"), "w") as meta:
+        json.dump({"name": name, "size": size, "created": time.time()}, meta, indent=4)
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # stored by another worker in the meantime
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    evict_search_cache(cache_dir, max_mb * 1024 * 1024)
+
+def restore_search_result(workspace: Path, key: str, name: str) -> list[str]:
+    """
+    Copy the cached outputs of a search into the result directory of a workspace.
+
+    Args:
+        workspace (Path): workspace directory.
+        key (str): cache key of the search, see search_cache_key.
+        name (str): protocol name of the new search (prefix of the output files).
+
+    Returns:
+        list[str]: names of the restored files, None if the search is not cached
+    """
+    entry = Path(get_search_cache_dir(workspace), key)
+    if not entry.is_dir():
+        return None
+
+    restored = []
+    for f in entry.iterdir():
+        if f.name == "meta.json":
+            continue
+        copy_file(f, Path(workspace, "result-files", name + f.name))
+        restored.append(name + f.name)
+    # the modification time of meta.json is the last use of the result (LRU)
+    os.utime(Path(entry, "meta.json"))
+    return restored
+
+def evict_search_cache(cache_dir: Path, max_bytes: int) -> None:
+    """
+    Remove the least recently used results until the cache is not larger than max_bytes.
+
+    Args:
+        cache_dir (Path): The search cache directory.
+        max_bytes (int): size limit of the cache.
+
+    Returns:
+        None
+    """
+    entries = []
+    for entry in cache_dir.iterdir():
+        try:
+            meta_path = Path(entry, "meta.json")
+            with open(meta_path) as meta:
+                entries.append((meta_path.stat().st_mtime, json.load(meta)["size"], entry))
+        except (OSError, ValueError, KeyError):
+            # temporary directories of running workers
+            continue
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
@@ -0,0 +1,550 @@
+import os
+import re
+import mmap
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+import streamlit as st
+from pathlib import Path
+from xml.sax.saxutils import unescape
+from pyopenms import MSExperiment, MzMLFile, OnDiscMSExperiment
+from src.common import file_hash
+
+######################### spectra of (.mzML) files #######
+
+# opening tag of a spectrum in the mzML, the attributes are parsed separately
+SPECTRUM_TAG = re.compile(rb'<spectrum\s([^>]*)>')
+SPECTRUM_ID = re.compile(rb'\bid="([^"]*)"')
+
+def get_spectrum_index_path(mzML_file: Path) -> Path:
+    """
+    Get the path of the spectrum index (sidecar file) of an mzML file.
+
+    The index lives in the "cache-files" directory of the workspace, its name contains the content hash of the mzML file.
+
+    Args:
+        mzML_file (Path): mzML file path.
+
+    Returns:
+        Path: Path of the spectrum index (.npz).
+    """
+    mzML_file = Path(mzML_file)
+    cache_dir = mzML_file.parent.with_name("cache-files")
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return Path(cache_dir, f"{mzML_file.name}.{file_hash(mzML_file)[:16]}.spectra.npz")
+
+def scan_number_of(native_id: str) -> int:
+    """
+    Get the scan number of a native ID (number after the last "=", like the ScanNr of the CSM table).
+
+    Args:
+        native_id (str): native ID of the spectrum, e.g. "controllerType=0 controllerNumber=1 scan=3850"
+
+    Returns:
+        int: scan number, -1 if the native ID has none
+    """
+    number = native_id[native_id.rfind('=') + 1 : ]
+    return int(number) if number.isdigit() else -1
+
+def build_spectrum_index(mzML_file: Path) -> Path:
+    """
+    Write the spectrum index of an mzML file: the native IDs of all spectra in file order,
+    found with a byte scan over the <spectrum> tags (no XML parsing, no peak decoding).
+
+    Args:
+        mzML_file (Path): mzML file path.
+
+    Returns:
+        Path: Path of the spectrum index, see get_spectrum_index_path
+    """
+    index_path = get_spectrum_index_path(mzML_file)
+    if index_path.exists():
+        return index_path
+
+    native_ids = []
+    with open(mzML_file, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for tag in SPECTRUM_TAG.finditer(mm):
+                native_id = SPECTRUM_ID.search(tag.group(1))
+                native_ids.append(unescape(native_id.group(1).decode()) if native_id else "")
+
+    native_ids = np.array(native_ids, dtype=str)
+    scan_numbers = np.array([scan_number_of(x) for x in native_ids], dtype=np.int64)
+
+    # write to a temporary file first, so other sessions never read a half written index,
+    # its name is unique, sessions are threads of one process and may index the same file at once
+    fd, tmp_path = tempfile.mkstemp(dir=index_path.parent, prefix=index_path.name + ".", suffix=".tmp.npz")
+    os.close(fd)
+    try:
+        np.savez(tmp_path, native_ids=native_ids, scan_numbers=scan_numbers)
+        os.replace(tmp_path, index_path)
+    finally:
+        Path(tmp_path).unlink(missing_ok=True)
+    # indices of older versions of this file are outdated now
+    for f in index_path.parent.glob(f"{Path(mzML_file).name}.*.spectra.npz"):
+        if f != index_path:
+            f.unlink(missing_ok=True)
+    return index_path
+
+@st.cache_resource(max_entries=32)
+def _load_spectrum_index(index_path: str) -> dict:
+    """
+    Load the lookup maps of a spectrum index, shared by all sessions.
+
+    Args:
+        index_path (str): Path of the spectrum index.
+
+    Returns:
+        dict: "native_id" -> dict native ID -> spectrum index, "scan" -> dict scan number -> spectrum index
+    """
+    data = np.load(index_path)
+    by_scan = {}
+    for i, scan in enumerate(data["scan_numbers"].tolist()):
+        if scan >= 0:
+            by_scan.setdefault(scan, i)
+    return {"native_id": {x: i for i, x in enumerate(data["native_ids"].tolist())}, "scan": by_scan}
+
+def get_spectrum_index(mzML_file: Path) -> dict:
+    """
+    Get the native ID and scan number lookup maps of an mzML file, built once and stored as sidecar file.
+
+    Args:
+        mzML_file (Path): mzML file path.
+
+    Returns:
+        dict: see _load_spectrum_index
+    """
+    return _load_spectrum_index(str(build_spectrum_index(mzML_file)))
+
+def find_spectrum(spectrum_index: dict, native_id: str) -> int:
+    """
+    Find the position of a spectrum in the mzML file, by native ID or else by scan number.
+
+    Args:
+        spectrum_index (dict): lookup maps, see get_spectrum_index
+        native_id (str): native ID of the spectrum (SpecId of the CSM).
+
+    Returns:
+        int: position of the spectrum, None if not found
+    """
+    i = spectrum_index["native_id"].get(native_id)
+    if i is None:
+        # native IDs written by other converters may differ, the scan number still matches
+        i = spectrum_index["scan"].get(scan_number_of(native_id))
+    return i
+
+def normalize_to_one(intensities: np.ndarray) -> np.ndarray:
+    """
+    Normalize peak intensities to the highest peak (like the pyOpenMS Normalizer, method "to_one").
+
+    Args:
+        intensities (np.ndarray): peak intensities.
+
+    Returns:
+        np.ndarray: normalized intensities (float32)
+    """
+    intensities = np.asarray(intensities, dtype=np.float32)
+    if intensities.size and intensities.max() > 0:
+        intensities = intensities / intensities.max()
+    return intensities
+
+######################### memory-mapped store of MS2 spectra #######
+
+# version of the spectrum store layout, part of the store name
+SPECTRUM_STORE_VERSION = 1
+
+def get_spectrum_store_path(mzML_file: Path) -> Path:
+    """
+    Get the path of the spectrum store (directory) of an mzML file.
+
+    The store lives in the "cache-files" directory of the workspace, its name contains the content hash of the mzML file.
+
+    Args:
+        mzML_file (Path): mzML file path.
+
+    Returns:
+        Path: Path of the spectrum store directory.
+    """
+    mzML_file = Path(mzML_file)
+    cache_dir = mzML_file.parent.with_name("cache-files")
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return Path(cache_dir, f"{mzML_file.name}.{file_hash(mzML_file)[:16]}.v{SPECTRUM_STORE_VERSION}.store")
+
+class SpectrumStoreWriter:
+    """
+    pyOpenMS spectrum consumer (see MzMLFile.transform) which writes the MS2 spectra of an mzML file into a spectrum store
+    while the file is read, so the spectra are never held in memory together.
+
+    Peaks are appended to flat binary buffers "mz.bin" (float64) and "intensity.bin" (float32),
+    the per-spectrum columns are written as numpy files by close().
+    """
+    def __init__(self, store_path):
+        self.store_path = Path(store_path)
+        self.mz_file = open(Path(store_path, "mz.bin"), "wb")
+        self.intensity_file = open(Path(store_path, "intensity.bin"), "wb")
+        # per spectrum columns, offsets[i]:offsets[i+1] are the peaks of spectrum i
+        self.offsets = [0]
+        self.precursor_mz = []
+        self.precursor_charge = []
+        self.rt = []
+        self.native_ids = []
+
+    def setExperimentalSettings(self, settings):
+        pass
+
+    def setExpectedSize(self, n_spectra, n_chromatograms):
+        pass
+
+    def consumeChromatogram(self, chromatogram):
+        pass
+
+    def consumeSpectrum(self, spectrum):
+        if spectrum.getMSLevel() != 2:
+            return
+        mz, intensity = spectrum.get_peaks()
+        self.mz_file.write(np.asarray(mz, dtype=np.float64).tobytes())
+        self.intensity_file.write(np.asarray(intensity, dtype=np.float32).tobytes())
+        self.offsets.append(self.offsets[-1] + len(mz))
+        precursors = spectrum.getPrecursors()
+        self.precursor_mz.append(precursors[0].getMZ() if precursors else np.nan)
+        self.precursor_charge.append(precursors[0].getCharge() if precursors else 0)
+        self.rt.append(spectrum.getRT())
+        self.native_ids.append(spectrum.getNativeID())
+
+    def close(self):
+        self.mz_file.close()
+        self.intensity_file.close()
+        np.save(Path(self.store_path, "offsets.npy"), np.array(self.offsets, dtype=np.int64))
+        np.save(Path(self.store_path, "precursor_mz.npy"), np.array(self.precursor_mz, dtype=np.float64))
+        np.save(Path(self.store_path, "precursor_charge.npy"), np.array(self.precursor_charge, dtype=np.int32))
+        np.save(Path(self.store_path, "rt.npy"), np.array(self.rt, dtype=np.float64))
+        np.save(Path(self.store_path, "native_ids.npy"), np.array(self.native_ids, dtype=str))
+
+def build_spectrum_store(mzML_file: Path) -> Path:
+    """
+    Extract the MS2 spectra of an mzML file into a spectrum store, run when the file is added to the workspace.
+
+    Args:
+        mzML_file (Path): mzML file path.
+
+    Returns:
+        Path: Path of the spectrum store, None if the file could not be read
+    """
+    store_path = get_spectrum_store_path(mzML_file)
+    if store_path.exists():
+        return store_path
+
+    # write to a temporary directory first, so other sessions never read a half written store,
+    # its name is unique, sessions are threads of one process and may extract the same file at once
+    tmp_path = Path(tempfile.mkdtemp(dir=store_path.parent, prefix=store_path.name + ".", suffix=".tmp"))
+    writer = SpectrumStoreWriter(tmp_path)
+    try:
+        MzMLFile().transform(str(mzML_file), writer)
+        writer.close()
+        tmp_path.rename(store_path)
+    except Exception as e:
+        writer.close()
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        # another session may have built the store meanwhile
+        if store_path.exists():
+            return store_path
+        st.warning(f"Spectra of {Path(mzML_file).name} could not be extracted ({e}), they are read from the mzML file instead (slower).")
+        return None
+
+    # stores of older versions of this file are outdated now
+    for f in store_path.parent.glob(f"{Path(mzML_file).name}.*.store"):
+        if f != store_path:
+            shutil.rmtree(f, ignore_errors=True)
+    return store_path
+
+@st.cache_resource(max_entries=32)
+def _load_spectrum_store(store_path: str) -> dict:
+    """
+    Memory-map the arrays of a spectrum store, shared by all sessions.
+
+    Args:
+        store_path (str): Path of the spectrum store.
+
+    Returns:
+        dict: "mz", "intensity" (flat peaks), "offsets", "precursor_mz", "precursor_charge", "rt", "native_ids" arrays
+              and the lookup maps "native_id" and "scan" (see _load_spectrum_index)
+    """
+    store = {}
+    for name, dtype in [("mz", np.float64), ("intensity", np.float32)]:
+        buffer = Path(store_path, f"{name}.bin")
+        # empty files can not be memory-mapped
+        store[name] = np.memmap(buffer, dtype=dtype, mode="r") if buffer.stat().st_size else np.empty(0, dtype=dtype)
+    for name in ["offsets", "precursor_mz", "precursor_charge", "rt", "native_ids"]:
+        store[name] = np.load(Path(store_path, f"{name}.npy"), mmap_mode="r")
+
+    native_ids = store["native_ids"].tolist()
+    by_scan = {}
+    for i, native_id in enumerate(native_ids):
+        scan = scan_number_of(native_id)
+        if scan >= 0:
+            by_scan.setdefault(scan, i)
+    store["native_id"] = {x: i for i, x in enumerate(native_ids)}
+    store["scan"] = by_scan
+    return store
+
+def get_spectrum_store(mzML_file: Path) -> dict:
+    """
+    Get the memory-mapped spectrum store of an mzML file.
+
+    Args:
+        mzML_file (Path): mzML file path.
+
+    Returns:
+        dict: see _load_spectrum_store, None if the store was not built (see build_spectrum_store)
+    """
+    store_path = get_spectrum_store_path(mzML_file)
+    if not store_path.exists():
+        return None
+    return _load_spectrum_store(str(store_path))
+
+def get_mz_intensities_from_store(store, native_id):
+    """
+    Extracts m/z values and corresponding normalized intensities of a spectrum from a spectrum store.
+
+    Parameters:
+    store (dict): spectrum store, see get_spectrum_store.
+    native_id (str): The native ID of the desired MS2 spectrum.
+
+    Returns:
+    tuple: m/z values (view into the store) and intensities normalized to the highest peak,
+           None if the specified native ID is not found.
+    """
+    i = find_spectrum(store, native_id)
+    if i is None:
+        return None
+    start, end = store["offsets"][i], store["offsets"][i + 1]
+    return store["mz"][start:end], normalize_to_one(store["intensity"][start:end])
+
+def match_annotations(mz, annotated_mz, annotation_codes, tolerance=20.0, unit="ppm"):
+    """
+    Align annotated peaks (e.g. of the idXML) to the peaks of a spectrum by m/z within a tolerance.
+
+    Args:
+        mz (np.ndarray): m/z values of the spectrum peaks, sorted ascending.
+        annotated_mz (np.ndarray): m/z values of the annotated peaks.
+        annotation_codes (np.ndarray): annotation code of each annotated peak.
+        tolerance (float): maximal m/z difference. Defaults to 20.0.
+        unit (str): unit of the tolerance, "ppm" or "Da". Defaults to "ppm".
+
+    Returns:
+        np.ndarray: annotation code of each spectrum peak (aligned with mz), -1 for peaks without annotation
+    """
+    mz = np.asarray(mz, dtype=np.float64)
+    annotated_mz = np.asarray(annotated_mz, dtype=np.float64)
+    codes = np.full(len(mz), -1, dtype=np.int32)
+    if len(mz) == 0 or len(annotated_mz) == 0:
+        return codes
+
+    # nearest spectrum peak of each annotated peak: left or right of its insertion point
+    right = np.searchsorted(mz, annotated_mz).clip(0, len(mz) - 1)
+    left = (right - 1).clip(0)
+    nearest = np.where(np.abs(mz[left] - annotated_mz) < np.abs(mz[right] - annotated_mz), left, right)
+    distance = np.abs(mz[nearest] - annotated_mz)
+    matched = distance <= (annotated_mz * tolerance * 1e-6 if unit == "ppm" else tolerance)
+
+    # several annotations of one peak: the closest one is assigned last and wins
+    order = np.argsort(-distance[matched], kind="stable")
+    codes[nearest[matched][order]] = np.asarray(annotation_codes)[matched][order]
+    return codes
+
+######################### pyOpenMS access to spectra #######
+
+def process_mzML_file(filepath):
+    """
+    Loads an mzML file.
+
+    Parameters:
+    filepath (str): The file path to the mzML file.
+
+    Returns:
+    MSExperiment: An MSExperiment object containing all spectra (in file order, see get_spectrum_index),
+                  None if the file can not be loaded.
+    """
+
+    try:
+        # Initialize an MSExperiment object
+        exp = MSExperiment()
+
+        # Load the mzML file into the MSExperiment object
+        MzMLFile().load(str(filepath), exp)
+
+        return exp
+
+    except Exception as e:
+        return None  # Return None if any exception occurs
+
+def open_mzML_file(filepath):
+    """
+    Opens an mzML file for reading single spectra.
+
+    Indexed mzML files are opened on disk: only the offset list at the end of the file is read,
+    each requested spectrum costs one seek and one decode. Other mzML files are loaded completely.
+
+    Parameters:
+    filepath (str): The file path to the mzML file.
+
+    Returns:
+    OnDiscMSExperiment or MSExperiment: spectra of the file in file order (see get_spectrum_index),
+                                        None if the file can not be loaded.
+    """
+    try:
+        on_disc = OnDiscMSExperiment()
+        # the meta data of the experiment is not needed to read spectra
+        if on_disc.openFile(str(filepath), True):
+            return on_disc
+    except Exception as e:
+        return None  # Return None if the file does not exist
+
+    # not an indexed mzML
+    return process_mzML_file(filepath)
+
+def get_mz_intensities_from_ms2(MS2_spectras, native_id, spectrum_index):
+    """
+    Extracts m/z values and corresponding normalized intensities from the spectrum with a specified native ID.
+
+    Parameters:
+    MS2_spectras (OnDiscMSExperiment or MSExperiment): the spectra of the mzML file, see open_mzML_file.
+    native_id (str): The native ID of the desired MS2 spectrum.
+    spectrum_index (dict): lookup maps of the mzML file, see get_spectrum_index
+
+    Returns:
+    tuple: A tuple containing two arrays:
+        - mz (np.ndarray): m/z values.
+        - intensities (np.ndarray): corresponding intensity values, normalized to the highest peak.
+
+    If the specified native ID is not found, the function returns None.
+    """
+    i = find_spectrum(spectrum_index, native_id)
+    if i is None or i >= MS2_spectras.getNrSpectra():
+        return None
+
+    # only the requested spectrum is normalized
+    mz, intensities = MS2_spectras.getSpectrum(i).get_peaks()
+    return mz, normalize_to_one(intensities)
+
+class SpectrumCache:
+    """
+    Process-wide LRU cache of opened mzML files and normalized spectra, bounded by a byte budget.
+
+    Entries are keyed by the content hash of the mzML file, so sessions viewing the same data share them.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0 # bytes of all entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key -> (value, bytes), least recently used first
+        # sessions run in threads, spectra of shared on disc experiments are read one at a time
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        """ get a cached value (None if not cached) and mark it as recently used """
+        with self.lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value, nbytes):
+        """ cache a value of the given size, least recently used values are evicted to stay in the budget """
+        with self.lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self.size += nbytes
+            # the newest entry is kept even if it alone exceeds the budget
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                self.size -= self._entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        """ remove all entries and reset the statistics """
+        with self.lock:
+            self._entries.clear()
+            self.size = self.hits = self.misses = 0
+
+    def stats(self):
+        """ current entries, size (bytes), budget (bytes), hits and misses """
+        with self.lock:
+            return {"entries": len(self._entries), "size": self.size, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
+
+@st.cache_resource
+def get_spectrum_cache(max_bytes: int) -> SpectrumCache:
+    """
+    Get the process-wide spectrum cache, shared by all sessions.
+
+    Args:
+        max_bytes (int): byte budget of the cache (setting "spectrum_cache_mb").
+
+    Returns:
+        SpectrumCache: the cache
+    """
+    return SpectrumCache(max_bytes)
+
+def load_mzML_file(filepath, spectrum_cache):
+    """
+    Opens an mzML file (see open_mzML_file) or takes the already opened file from the cache.
+
+    Parameters:
+    filepath (str): The file path to the mzML file.
+    spectrum_cache (SpectrumCache): cache of opened files and spectra.
+
+    Returns:
+    OnDiscMSExperiment or MSExperiment: spectra of the file, None if the file can not be loaded.
+    """
+    if not Path(filepath).is_file():
+        return None
+    key = ("experiment", file_hash(Path(filepath)))
+    exp = spectrum_cache.get(key)
+    if exp is None:
+        exp = open_mzML_file(filepath)
+        if exp is None:
+            return None
+        if isinstance(exp, OnDiscMSExperiment):
+            nbytes = 8 * exp.getNrSpectra() # offsets only
+        else:
+            # peaks of all spectra: double m/z, float intensity (padded)
+            nbytes = 16 * sum(spectrum.size() for spectrum in exp)
+        spectrum_cache.put(key, exp, nbytes)
+    return exp
+
+def get_spectrum_peaks(filepath, native_id, spectrum_cache):
+    """
+    Extracts m/z values and normalized intensities of one spectrum, from the spectrum store if the file has one,
+    else from the (cached) opened file, see get_mz_intensities_from_ms2.
+
+    Parameters:
+    filepath (str): The file path to the mzML file.
+    native_id (str): The native ID of the desired MS2 spectrum.
+    spectrum_cache (SpectrumCache): cache of opened files and spectra.
+
+    Returns:
+    tuple: m/z values and normalized intensities, None if the file or spectrum is not found.
+    """
+    if not Path(filepath).is_file():
+        return None
+    # spectra of the memory-mapped store are page cache hits, they are not cached again
+    store = get_spectrum_store(filepath)
+    if store is not None:
+        return get_mz_intensities_from_store(store, native_id)
+
+    key = ("spectrum", file_hash(Path(filepath)), native_id)
+    peaks = spectrum_cache.get(key)
+    if peaks is None:
+        MS2 = load_mzML_file(filepath, spectrum_cache)
+        if MS2 is None:
+            return None
+        with spectrum_cache.lock:
+            peaks = get_mz_intensities_from_ms2(MS2, native_id, get_spectrum_index(filepath))
+        if peaks is None:
+            return None
+        spectrum_cache.put(key, peaks, peaks[0].nbytes + peaks[1].nbytes)
+    return peaks
@@ -3,10 +3,61 @@ import pandas as pd
 from pathlib import Path
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
 import streamlit as st
+from src.common import file_hash
 
-@st.cache_resource
-def plot_ms2_spectrum(spec, title, color):
+# number of m/z bins of a drawn spectrum: at most one unannotated peak per bin is drawn
+MAX_SPECTRUM_BINS = 2000
+
+def decimate_peaks(mz, intensity, annotated, mz_range=None, max_bins=MAX_SPECTRUM_BINS):
+    """
+    Select the peaks to draw: the peaks within the m/z range, decimated to the highest peak (local maximum)
+    of each of max_bins m/z bins at this zoom width, plus all annotated peaks.
+
+    Args:
+        mz: m/z values of the peaks.
+        intensity: intensities of the peaks.
+        annotated: bool array, True for annotated peaks.
+        mz_range: (min, max) m/z range to draw. Defaults to None, all peaks.
+        max_bins: number of m/z bins. Defaults to MAX_SPECTRUM_BINS.
+
+    Returns:
+        np.ndarray: indices of the selected peaks (ascending)
+    """
+    mz = np.asarray(mz, dtype=float)
+    intensity = np.asarray(intensity, dtype=float)
+    if len(mz) == 0:
+        return np.arange(0)
+    low, high = mz_range if mz_range is not None else (mz.min(), mz.max())
+    in_range = np.flatnonzero((mz >= low) & (mz <= high))
+    if len(in_range) <= max_bins or high <= low:
+        return in_range
+
+    # highest peak of each bin: sort by bin, then by decreasing intensity, take the first of each bin
+    bins = np.minimum(((mz[in_range] - low) / (high - low) * max_bins).astype(np.int64), max_bins - 1)
+    order = np.lexsort((-intensity[in_range], bins))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = bins[order][1:] != bins[order][:-1]
+    return np.union1d(in_range[order[first]], in_range[np.asarray(annotated)[in_range]])
+
+def decimate_spectrum(spec, mz_range=None, max_bins=MAX_SPECTRUM_BINS):
+    """
+    Decimate a spectrum for drawing, see decimate_peaks.
+
+    Args:
+        spec: spectrum with "mzarray", "intarray" and "anotarray" columns.
+        mz_range: (min, max) m/z range to draw. Defaults to None, all peaks.
+        max_bins: number of m/z bins. Defaults to MAX_SPECTRUM_BINS.
+
+    Returns:
+        pd.DataFrame: the selected peaks
+    """
+    spec = pd.DataFrame({c: np.asarray(spec[c]) for c in ["mzarray", "intarray", "anotarray"]})
+    annotated = spec["anotarray"].fillna("").astype(str).str.strip().ne("").to_numpy()
+    return spec.iloc[decimate_peaks(spec["mzarray"], spec["intarray"], annotated, mz_range, max_bins)]
+
+def plot_ms2_spectrum(spec, title, color, webgl=False, mz_range=None):
     """
     Takes a pandas Series (spec) and generates a needle plot with m/z and intensity dimension, also annotate ions.
 
@@ -15,10 +66,14 @@ def plot_ms2_spectrum(spec, title, color):
               "mzarray" {ions m/z ratio}, "intarray" {ion intensities} and "anotarray" {ions annotation} columns.
         title: Title of the plot.
         color: Color of the line in the plot.
+        webgl: Render with WebGL (for spectra with many peaks). Defaults to False.
+        mz_range: (min, max) m/z range to draw, the peaks are decimated at this zoom width (see decimate_peaks).
+                  Defaults to None, the whole spectrum.
 
     Returns:
         A Plotly Figure object representing the needle plot of the mass spectrum.
     """
+    spec = decimate_spectrum(spec, mz_range)
 
     # Every Peak is represented by three dots in the line plot: (x, 0), (x, y), (x, 0)
     def create_spectra(x, y, zero=0):
@@ -28,7 +83,7 @@ def plot_ms2_spectrum(spec, title, color):
         return pd.DataFrame({"mz": x, "intensity": y})
 
     df = create_spectra(spec["mzarray"], spec["intarray"])
-    fig = px.line(df, x="mz", y="intensity")
+    fig = px.line(df, x="mz", y="intensity", render_mode="webgl" if webgl else "svg")
     fig.update_traces(line_color=color,  line_width=1)
     fig.update_layout(
         showlegend=True,
@@ -39,6 +94,8 @@ def plot_ms2_spectrum(spec, title, color):
     )
     fig.layout.template = "plotly_white"
     fig.update_yaxes(fixedrange=True)
+    if mz_range is not None:
+        fig.update_xaxes(range=list(mz_range))
 
     # Annotate every line with a string
     for mz, intensity, annotation in zip(spec["mzarray"], spec["intarray"], spec["anotarray"]):
@@ -73,8 +130,59 @@ def plot_ms2_spectrum(spec, title, color):
 
     return fig
 
-@st.cache_resource
-def plot_ms2_spectrum_full(spec, title, base_color):
+# ion classes of the annotations (checked in this order): substring of the annotation -> legend name, color
+ION_CLASSES = {"MI": ("MI ions", '#ff0000'), "y": ("y ions", 'green'), "[M": ("precursor ions", 'darkmagenta')}
+# annotations of no other ion class
+OTHER_ION_CLASS = ("other ions", 'blue')
+
+def add_batched_annotations(fig, mz, intensity, annotation, Scatter=go.Scatter):
+    """
+    Draws the annotated peaks of a spectrum with one NaN-separated stick trace per ion class
+    and all labels in one text trace, so the number of traces does not grow with the number of peaks.
+
+    Args:
+        fig: Plotly Figure to add the traces to.
+        mz: m/z values of the peaks.
+        intensity: intensities of the peaks.
+        annotation: annotations of the peaks, empty or missing for peaks without annotation.
+        Scatter: trace type, go.Scatter or go.Scattergl (WebGL). Defaults to go.Scatter.
+
+    Returns:
+        None
+    """
+    mz = np.asarray(mz, dtype=float)
+    intensity = np.asarray(intensity, dtype=float)
+    annotation = pd.Series(annotation, dtype=object).fillna("").astype(str).to_numpy(dtype=str)
+    annotated = np.char.strip(annotation) != ""
+
+    # ion class of each peak, the first matching class wins
+    unassigned = annotated.copy()
+    label_colors = np.empty(len(mz), dtype=object)
+    for marker, (name, color) in list(ION_CLASSES.items()) + [("", OTHER_ION_CLASS)]:
+        in_class = unassigned & (np.char.find(annotation, marker) >= 0)
+        unassigned &= ~in_class
+        if not in_class.any():
+            continue
+        label_colors[in_class] = color
+        # every peak is represented by (x, 0), (x, y), (NaN, NaN) in one line trace
+        x = np.repeat(mz[in_class], 3)
+        y = np.repeat(intensity[in_class], 3)
+        y[::3] = 0
+        x[2::3] = y[2::3] = np.nan
+        fig.add_trace(Scatter(x=x, y=y, mode='lines', line=dict(color=color, width=1), name=name, connectgaps=False))
+
+    # all labels in one text trace above the peaks
+    fig.add_trace(Scatter(
+        x=mz[annotated], y=intensity[annotated],
+        mode='text',
+        text=annotation[annotated],
+        textposition='top center',
+        textfont=dict(size=12, color=label_colors[annotated].tolist()),
+        hoverinfo='skip',
+        showlegend=False
+    ))
+
+def plot_ms2_spectrum_full(spec, title, base_color, batched=True, webgl=False, mz_range=None):
     """
     Takes a pandas Series (spec) and generates a needle plot with m/z and intensity dimension, also annotates ions.
     
@@ -83,10 +191,17 @@ def plot_ms2_spectrum_full(spec, title, base_color):
               "mzarray" {ions m/z ratio}, "intarray" {ion intensities} and "anotarray" {ions annotation} columns.
         title: Title of the plot.
         base_color: Base color for the line.
+        batched: Draw the annotated peaks with one trace per ion class and all labels in one trace (default True),
+                 else with one trace and one layout annotation (vertical label) per annotated peak.
+        webgl: Render with WebGL (Scattergl, for spectra with many peaks). Defaults to False.
+        mz_range: (min, max) m/z range to draw, the peaks are decimated at this zoom width (see decimate_peaks).
+                  Defaults to None, the whole spectrum.
 
     Returns:
         A Plotly Figure object representing the needle plot of the mass spectrum.
     """
+    spec = decimate_spectrum(spec, mz_range)
+    Scatter = go.Scattergl if webgl else go.Scatter
     
     # Every Peak is represented by three dots in the line plot: (x, 0), (x, y), (x, 0)
     def create_spectra(x, y, zero=0):
@@ -101,55 +216,58 @@ def plot_ms2_spectrum_full(spec, title, base_color):
     fig = go.Figure()
 
     # Add base line with a meaningful name
-    fig.add_trace(go.Scatter(
+    fig.add_trace(Scatter(
         x=df["mz"], y=df["intensity"], 
         mode='lines', 
         line=dict(color=base_color, width=1),
         name='Annotated peaks'  
     ))
 
-    # Annotate every line with a string if annotation exists
-    for mz, intensity, annotation in zip(spec["mzarray"], spec["intarray"], spec["anotarray"]):
-        if pd.isna(annotation) or annotation.strip() == "":
-            continue  # Skip annotation if it's missing or empty
+    if batched:
+        add_batched_annotations(fig, spec["mzarray"], spec["intarray"], spec["anotarray"], Scatter)
+    else:
+        # Annotate every line with a string if annotation exists
+        for mz, intensity, annotation in zip(spec["mzarray"], spec["intarray"], spec["anotarray"]):
+            if pd.isna(annotation) or annotation.strip() == "":
+                continue  # Skip annotation if it's missing or empty
 
-        if intensity < 0.3:
-            yshift_ = 60  # Adjust this value for peaks with high intensity
-        else:
-            yshift_ = 20  # Adjust this value for peaks with low intensity
+            if intensity < 0.3:
+                yshift_ = 60  # Adjust this value for peaks with high intensity
+            else:
+                yshift_ = 20  # Adjust this value for peaks with low intensity
 
-        # Change the annotation color according to ion-type
-        if "MI" in annotation:
-            annotation_color = '#ff0000'  # Red for MI
-        elif "y" in annotation:
-            annotation_color = 'green'  # Green for y
-        elif "[M" in annotation:
-            annotation_color = 'darkmagenta'  # Dark Magenta for M
-        else:
-            annotation_color = 'blue'  # Default color for other annotations
+            # Change the annotation color according to ion-type
+            if "MI" in annotation:
+                annotation_color = '#ff0000'  # Red for MI
+            elif "y" in annotation:
+                annotation_color = 'green'  # Green for y
+            elif "[M" in annotation:
+                annotation_color = 'darkmagenta'  # Dark Magenta for M
+            else:
+                annotation_color = 'blue'  # Default color for other annotations
 
-        # Add annotation
-        fig.add_annotation(
-            x=mz,
-            y=intensity,
-            text=annotation,
-            showarrow=False,
-            arrowhead=1,
-            arrowcolor=annotation_color,
-            font=dict(size=12, color=annotation_color),
-            xshift=0,
-            yshift=yshift_,
-            textangle=90  # Vertical
-        )
+            # Add annotation
+            fig.add_annotation(
+                x=mz,
+                y=intensity,
+                text=annotation,
+                showarrow=False,
+                arrowhead=1,
+                arrowcolor=annotation_color,
+                font=dict(size=12, color=annotation_color),
+                xshift=0,
+                yshift=yshift_,
+                textangle=90  # Vertical
+            )
 
-        # Add a vertical line at the position of the peak with the annotation color
-        fig.add_trace(go.Scatter(
-            x=[mz, mz],
-            y=[0, intensity],
-            mode='lines',
-            line=dict(color=annotation_color, width=1),
-            showlegend=False
-        ))
+            # Add a vertical line at the position of the peak with the annotation color
+            fig.add_trace(Scatter(
+                x=[mz, mz],
+                y=[0, intensity],
+                mode='lines',
+                line=dict(color=annotation_color, width=1),
+                showlegend=False
+            ))
 
     fig.update_layout(
         showlegend=True,
@@ -160,5 +278,43 @@ def plot_ms2_spectrum_full(spec, title, base_color):
     )
     fig.layout.template = "plotly_white"
     fig.update_yaxes(fixedrange=True)
+    if mz_range is not None:
+        fig.update_xaxes(range=list(mz_range))
 
-    return fig
\ No newline at end of file
+    return fig
+
+# bounds of the spectrum figure cache: number of figures and seconds a figure is kept
+FIGURE_CACHE_ENTRIES = 256
+FIGURE_CACHE_TTL = 3600
+
+@st.cache_data(max_entries=FIGURE_CACHE_ENTRIES, ttl=FIGURE_CACHE_TTL, show_spinner=False)
+def _spectrum_figure_json(result_hash, spec_id, options, _build):
+    """
+    Build a spectrum figure and keep it as JSON, cached by the (small) key arguments only:
+    _build is not hashed by streamlit.
+
+    Args:
+        result_hash: content hash of the result file.
+        spec_id: SpecId of the CSM.
+        options: tuple of all other inputs of the figure (render options, title, ...).
+        _build: function without arguments returning the figure.
+
+    Returns:
+        str: the figure as JSON
+    """
+    return _build().to_json()
+
+def get_spectrum_figure(result_file, spec_id, options, build):
+    """
+    Get the spectrum figure of a CSM from the figure cache, build it only if it is not cached.
+
+    Args:
+        result_file: idXML file path of the CSM.
+        spec_id: SpecId of the CSM.
+        options: all other inputs of the figure (render options, title, mzML file hash, ...), must be hashable.
+        build: function without arguments returning the figure, e.g. calling plot_ms2_spectrum_full.
+
+    Returns:
+        A Plotly Figure object
+    """
+    return pio.from_json(_spectrum_figure_json(file_hash(Path(result_file)), spec_id, tuple(options), build))
@@ -0,0 +1,63 @@
+import sys
+import time
+import pytest
+from pathlib import Path
+from src.jobs import submit_job, read_job, get_job_dir, ACTIVE_JOB_STATES, JOB_DONE
+
+REPOSITORY_DIR = Path(__file__).resolve().parent.parent
+
+# stand-in for OpenNuXL: writes the -out file and a CSM file with the value of -opt, and logs it
+SEARCH = """
+import sys
+args = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+out = args["-out"]
+for path in [out, out[:-len(".idXML")] + "_perc_0.0100_XLs.idXML"]:
+    with open(path, "w") as f:
+        f.write("opt " + args["-opt"])
+print("searched with opt", args["-opt"])
+"""
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    # the workers run "python -m src.jobs" in the current directory
+    monkeypatch.chdir(REPOSITORY_DIR)
+    workspace = Path(tmp_path, "workspaces", "test")
+    for d in ["mzML-files", "fasta-files", "result-files"]:
+        Path(workspace, d).mkdir(parents=True)
+    Path(workspace, "mzML-files", "s.mzML").write_text("<mzML/>")
+    Path(workspace, "fasta-files", "db.fasta").write_text(">P1\nPEPTIDE\n")
+    return workspace
+
+def search(workspace, opt):
+    args = [sys.executable, "-c", SEARCH, "-in", str(Path(workspace, "mzML-files", "s.mzML")),
+            "-database", str(Path(workspace, "fasta-files", "db.fasta")),
+            "-out", str(Path(workspace, "result-files", "s.idXML")), "-opt", opt]
+    job = submit_job(workspace, args, "s", cache_mb=100)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        job = read_job(get_job_dir(workspace, job["id"]))
+        if job["status"] not in ACTIVE_JOB_STATES:
+            return job
+        time.sleep(0.2)
+    raise TimeoutError(f"job {job['id']} did not finish")
+
+def test_cached_result_not_changed_by_later_search(workspace):
+    result_dir = Path(workspace, "result-files")
+
+    first = search(workspace, "1")
+    assert first["status"] == JOB_DONE and not first["cached"]
+
+    # same file, other settings: searched again, the outputs and the log are written again
+    second = search(workspace, "2")
+    assert second["status"] == JOB_DONE and not second["cached"]
+    assert Path(result_dir, "s.idXML").read_text() == "opt 2"
+
+    # the first settings again: restored from the cache, with the results of the first search
+    third = search(workspace, "1")
+    assert third["status"] == JOB_DONE and third["cached"]
+    assert Path(result_dir, "s.idXML").read_text() == "opt 1"
+    assert Path(result_dir, "s_perc_0.0100_XLs.idXML").read_text() == "opt 1"
+    assert "searched with opt 1" in Path(result_dir, "s_log.txt").read_text()
+
+    # the cache is not a directory in the workspaces directory (every directory there is a workspace)
+    assert [d.name for d in workspace.parent.iterdir()] == ["test"]
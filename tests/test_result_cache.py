@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pathlib import Path
+from src.result_files import PeakAnnotations, iter_idXML_batches, concat_CSM_batches
+from src.result_cache import write_CSM_cache, write_CSM_cache_batches, open_CSM_cache, PEAK_COLUMNS
+
+EXAMPLE_IDXML = Path(__file__).resolve().parent.parent / "example-data" / "idXMLs" / "Example_perc_0.0100_XLs.idXML"
+
+def assert_same_tables(expected_path, actual_path):
+    expected, actual = open_CSM_cache(expected_path), open_CSM_cache(actual_path)
+    assert actual.column_names == expected.column_names
+    assert actual.schema.metadata[b"ion_labels"] == expected.schema.metadata[b"ion_labels"]
+    expected_df, actual_df = expected.to_pandas(), actual.to_pandas()
+    for name in expected_df.columns:
+        if name in PEAK_COLUMNS:
+            assert all(np.array_equal(e, a) for e, a in zip(expected_df[name], actual_df[name]))
+        else:
+            assert actual_df[name].dtype == expected_df[name].dtype, name
+            pd.testing.assert_series_equal(actual_df[name], expected_df[name])
+
+def test_batches_written_like_concatenated_table(tmp_path):
+    for batch_size in [3, 10]:
+        write_CSM_cache(*concat_CSM_batches(list(iter_idXML_batches(EXAMPLE_IDXML, batch_size=batch_size))), tmp_path / "concat.arrow")
+        assert write_CSM_cache_batches(iter_idXML_batches(EXAMPLE_IDXML, batch_size=batch_size), tmp_path / "batches.arrow")
+        assert_same_tables(tmp_path / "concat.arrow", tmp_path / "batches.arrow")
+    # only the cache files are left, the spilled batches are removed
+    assert sorted(f.name for f in tmp_path.iterdir()) == ["batches.arrow", "concat.arrow"]
+
+def test_batches_with_different_columns(tmp_path):
+    def peaks(n, ion_labels):
+        return PeakAnnotations.from_lists([100.0] * n, [1.0] * n, [n % len(ion_labels)] * n, ion_labels, [1] * n)
+    batches = [
+        (pd.DataFrame({"SpecId": ["a", "b"], "int_float": [1, 2], "NuXL:NA": pd.Categorical(["none", "U"]), "int_str": [1, 2]}),
+         peaks(2, ["y1"])),
+        # a meta value found in a later batch, a column promoted to float, another one to strings
+        (pd.DataFrame({"SpecId": ["c", "d"], "int_float": [1.5, np.nan], "NuXL:NA": pd.Categorical(["U", "G"]),
+                       "late": pd.array([3, None], dtype="Int64"), "int_str": ["x", "y"]}),
+         peaks(2, ["y1", "b2"])),
+        (pd.DataFrame({"SpecId": ["e"], "int_float": [4.0], "NuXL:NA": ["C"], "int_str": [3]}),
+         peaks(1, ["y1", "b2"])),
+    ]
+    write_CSM_cache(*concat_CSM_batches(batches), tmp_path / "concat.arrow")
+    assert write_CSM_cache_batches(batches, tmp_path / "batches.arrow")
+    assert_same_tables(tmp_path / "concat.arrow", tmp_path / "batches.arrow")
+
+def test_no_batches(tmp_path):
+    assert not write_CSM_cache_batches([], tmp_path / "batches.arrow")
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,45 @@
+import re
+import numpy as np
+import pandas as pd
+import pytest
+from pathlib import Path
+from src.result_files import readAndProcessIdXML, iter_idXML_batches, concat_CSM_batches
+
+EXAMPLE_IDXML = Path(__file__).resolve().parent.parent / "example-data" / "idXMLs" / "Example_perc_0.0100_XLs.idXML"
+
+def without_first_annotation(input_file, output_file):
+    """
+    copy an idXML file, the first hit loses its fragment_annotation UserParam
+    """
+    text = Path(input_file).read_text()
+    text, n = re.subn(r'\s*<UserParam type="string" name="fragment_annotation" value="[^"]*"/>', "", text, count=1)
+    assert n == 1
+    Path(output_file).write_text(text)
+    return output_file
+
+@pytest.fixture(params=["example", "hit without annotation"])
+def idXML_file(request, tmp_path):
+    if request.param == "example":
+        return EXAMPLE_IDXML
+    return without_first_annotation(EXAMPLE_IDXML, tmp_path / "no_annotation_XLs.idXML")
+
+def test_parsers_agree(idXML_file):
+    df, peaks = readAndProcessIdXML(idXML_file)
+    # small batches, the peaks of several batches are concatenated
+    streamed_df, streamed_peaks = concat_CSM_batches(list(iter_idXML_batches(idXML_file, batch_size=10)))
+
+    assert set(streamed_df.columns) == set(df.columns)
+    pd.testing.assert_frame_equal(streamed_df[df.columns], df)
+
+    # one peak list per CSM
+    assert len(peaks) == len(df)
+    assert len(streamed_peaks) == len(df)
+    np.testing.assert_array_equal(streamed_peaks.offsets, peaks.offsets)
+    np.testing.assert_allclose(streamed_peaks.mz, peaks.mz)
+    np.testing.assert_array_equal(streamed_peaks.intensity, peaks.intensity)
+    assert list(streamed_peaks.ion_labels[streamed_peaks.ion_codes]) == list(peaks.ion_labels[peaks.ion_codes])
+
+def test_hit_without_annotation_has_no_peaks(tmp_path):
+    idXML_file = without_first_annotation(EXAMPLE_IDXML, tmp_path / "no_annotation_XLs.idXML")
+    _, peaks = concat_CSM_batches(list(iter_idXML_batches(idXML_file)))
+    assert len(peaks.row(0)[0]) == 0